@@ -0,0 +1,105 @@
+import hashlib
+from calendar import timegm
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from api.filecache import normalized_query
+from api.models import DatasetVersion
+
+
+class CachedResponseMixin(object):
+    """
+    Viewset mixin that caches rendered GET responses in the cache configured by settings.API_CACHE_ALIAS and
+    answers conditional GETs.
+
+    Responses are keyed by scheme, host, path, normalized query string, Accept header and the load versions of the
+    datasets the viewset reads from. Loaders bump those versions through DatasetVersion.objects.bump, as do writes
+    through the viewset, so cached responses are invalidated exactly when the underlying tables change. The same
+    key is sent as a strong ETag along with the dataset load time as Last-Modified, and matching
+    If-None-Match/If-Modified-Since requests get a 304 that only needs the DatasetVersion lookup. Responses larger
+    than settings.API_CACHE_MAX_RESPONSE_SIZE bytes are not stored.
+
+    Actions listed in the viewset's uncached_actions, whose responses are cached some other way, still get the
+    validators and 304s but are not stored in the cache.
+    """
+    # models the responses are built from, defaults to the model of the viewset's queryset
+    cache_models = None
+
+    def get_cache_models(self):
+        if self.cache_models is not None:
+            return self.cache_models
+        return [self.queryset.model]
+
+    def get_cache_key(self, request, versions):
+        query = normalized_query(request.GET)
+        versions = ','.join('{}:{}'.format(k, v) for k, v in sorted(versions.items()))
+        # pages and the browsable API contain absolute links, so responses differ by scheme and host
+        key = '|'.join([request.scheme, request.get_host(), request.path, query, request.META.get('HTTP_ACCEPT', ''), versions])
+        return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def set_validators(self, response, etag, last_modified):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def set_view_headers(self, response):
+        """
+        Adds the Allow and Vary headers that finalize_response adds to responses rendered by the view, for responses
+        that skip it. Vary always includes Accept, since the Accept header is part of the cache key.
+        """
+        headers = self.default_response_headers
+        response['Allow'] = headers['Allow']
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+    def bump_written_models(self):
+        """
+        Bumps the version of the viewset's table and of the tables with foreign keys to it, which deletes cascade to,
+        after a write through the API.
+        """
+        model = self.queryset.model
+        for written in [model] + [r.related_model for r in model._meta.related_objects]:
+            DatasetVersion.objects.bump(written)
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            response = super().dispatch(request, *args, **kwargs)
+            if request.method in ('POST', 'PUT', 'PATCH', 'DELETE') and response.status_code < 400:
+                self.bump_written_models()
+            return response
+
+        versions, last_loaded = DatasetVersion.objects.load_info(*self.get_cache_models())
+        key = self.get_cache_key(request, versions)
+        etag = quote_etag(key)
+        last_modified = timegm(last_loaded.utctimetuple()) if last_loaded is not None else None
+
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return self.set_view_headers(self.set_validators(not_modified, etag, last_modified))
+
+        # HEAD requests are answered by the GET action
+        if self.action_map.get('get') in getattr(self, 'uncached_actions', ()):
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code == 200:
+                self.set_validators(response, etag, last_modified)
+                self.set_view_headers(response)
+            return response
+
+        cache = caches[settings.API_CACHE_ALIAS]
+        cached = cache.get('api.response.' + key)
+        if cached is not None:
+            content, content_type = cached
+            return self.set_view_headers(self.set_validators(HttpResponse(content, content_type=content_type), etag, last_modified))
+
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            response.render()
+            # large lists would fill the memory of every worker
+            if len(response.content) <= settings.API_CACHE_MAX_RESPONSE_SIZE:
+                cache.set('api.response.' + key, (response.content, response['Content-Type']))
+            self.set_validators(response, etag, last_modified)
+            self.set_view_headers(response)
+        return response
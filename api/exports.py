@@ -0,0 +1,171 @@
+import importlib.util
+import os
+import subprocess
+from django.conf import settings
+from django.contrib.gis.db.models import GeometryField
+from django.db import models
+from django.db import connections
+from django.http import FileResponse
+from rest_framework import status
+from rest_framework.decorators import list_route
+from rest_framework.exceptions import APIException, ParseError
+from api.filecache import VersionedFileCache, filter_params, query_digest
+from api.models import DatasetVersion
+
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'parquet': 'application/octet-stream',
+    'gpkg': 'application/geopackage+sqlite3',
+    'fgb': 'application/octet-stream',
+}
+# formats written by ogr2ogr, only available for models with a geometry field
+OGR_DRIVERS = {
+    'gpkg': 'GPKG',
+    'fgb': 'FlatGeobuf',
+}
+# number of rows converted to Parquet at a time
+PARQUET_CHUNK_SIZE = 100000
+
+class ExportUnavailable(APIException):
+    status_code = status.HTTP_501_NOT_IMPLEMENTED
+    default_detail = 'This export format is not available on this server.'
+    default_code = 'export_unavailable'
+
+def pg_dsn(connection):
+    """
+    Returns an OGR PostgreSQL connection string for a Django database connection. The password is left out since
+    command line arguments can be read by other users, it is passed to ogr2ogr in PGPASSWORD instead.
+    """
+    params = connection.settings_dict
+    parts = {'dbname': params['NAME'], 'user': params['USER'], 'host': params['HOST'], 'port': params['PORT']}
+    return 'PG:' + ' '.join("{}='{}'".format(k, v) for k, v in parts.items() if v)
+
+def parquet_type(field, pyarrow):
+    """
+    Returns the pandas dtype a field's column is read from the CSV export with and the pyarrow type it is written
+    to Parquet as. Text, dates and geometries stay strings so that codes keep their leading zeros, integers that
+    can be null are floats.
+    """
+    if field.is_relation:
+        field = field.target_field
+    if isinstance(field, (models.BooleanField, models.NullBooleanField)):
+        return str, pyarrow.bool_()
+    if isinstance(field, (models.IntegerField, models.AutoField)):
+        return ('float64', pyarrow.float64()) if field.null else ('int64', pyarrow.int64())
+    if isinstance(field, (models.FloatField, models.DecimalField)):
+        return 'float64', pyarrow.float64()
+    return str, pyarrow.string()
+
+class ExportMixin(object):
+    """
+    Viewset mixin that adds an export endpoint returning the whole filtered dataset as a file.
+
+    The file_format query parameter selects csv (the default), parquet, or for models with a geometry field gpkg
+    (GeoPackage) and fgb (FlatGeobuf). Rows are read with a single COPY ... TO STDOUT, or by ogr2ogr for the
+    spatial formats, and the file is cached under settings.EXPORT_CACHE_DIR until the dataset is next loaded. Files
+    are keyed by the filters applied, so other query parameters don't generate new exports, and at most
+    settings.EXPORT_CACHE_MAX_FILES are kept per dataset.
+    Geometries are written as WKT in csv and parquet.
+    """
+    # fields left out of exports
+    export_exclude = ()
+
+    def get_export_fields(self):
+        return [f for f in self.queryset.model._meta.concrete_fields if f.name not in self.export_exclude]
+
+    def get_export_cache(self):
+        table = self.queryset.model._meta.db_table
+        versions, last_loaded = DatasetVersion.objects.load_info(self.queryset.model)
+        return VersionedFileCache(settings.EXPORT_CACHE_DIR, table, versions[table], max_files=settings.EXPORT_CACHE_MAX_FILES)
+
+    def export_sql(self, queryset, connection, wkt=True):
+        """
+        Returns the SELECT of the export fields of the rows in queryset, with the parameters inlined so that it can be
+        run by COPY or ogr2ogr.
+        """
+        opts = queryset.model._meta
+        qn = connection.ops.quote_name
+        columns = []
+        for field in self.get_export_fields():
+            column = 't.' + qn(field.column)
+            if wkt and isinstance(field, GeometryField):
+                column = 'ST_AsText({})'.format(column)
+            columns.append('{} AS {}'.format(column, qn(field.name)))
+
+        pk_sql, pk_params = queryset.order_by().values('pk').query.sql_with_params()
+        sql = 'SELECT {columns} FROM {table} AS t WHERE t.{pk} IN ({pk_sql}) ORDER BY t.{pk}'.format(
+            columns=', '.join(columns),
+            table=qn(opts.db_table),
+            pk=qn(opts.pk.column),
+            pk_sql=pk_sql,
+        )
+        with connection.cursor() as cursor:
+            return cursor.mogrify(sql, pk_params).decode('utf-8')
+
+    def write_csv(self, queryset, path):
+        connection = connections[queryset.db]
+        sql = self.export_sql(queryset, connection)
+        with open(path, 'w', encoding='utf-8') as f, connection.cursor() as cursor:
+            cursor.copy_expert('COPY ({}) TO STDOUT WITH CSV HEADER'.format(sql), f)
+
+    def write_parquet(self, queryset, path):
+        if importlib.util.find_spec('pandas') is None or importlib.util.find_spec('pyarrow') is None:
+            raise ExportUnavailable('Parquet exports need pandas and pyarrow.')
+        import pandas
+        import pyarrow
+        import pyarrow.parquet
+
+        fields = self.get_export_fields()
+        types = {f.name: parquet_type(f, pyarrow) for f in fields}
+        schema = pyarrow.schema([pyarrow.field(f.name, types[f.name][1]) for f in fields])
+        booleans = [name for name, (dtype, arrow_type) in types.items() if arrow_type == pyarrow.bool_()]
+
+        csv_path = path + '.csv'
+        try:
+            self.write_csv(queryset, csv_path)
+            # converted a chunk at a time so that the table is never held in memory
+            writer = pyarrow.parquet.ParquetWriter(path, schema)
+            try:
+                chunks = pandas.read_csv(csv_path, dtype={name: dtype for name, (dtype, arrow_type) in types.items()}, chunksize=PARQUET_CHUNK_SIZE)
+                for chunk in chunks:
+                    for name in booleans:
+                        chunk[name] = chunk[name].map({'t': True, 'f': False})
+                    writer.write_table(pyarrow.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            finally:
+                writer.close()
+        finally:
+            os.remove(csv_path)
+
+    def write_ogr(self, queryset, path, file_format):
+        connection = connections[queryset.db]
+        sql = self.export_sql(queryset, connection, wkt=False)
+        command = ['ogr2ogr', '-f', OGR_DRIVERS[file_format], path, pg_dsn(connection), '-sql', sql, '-nln', self.queryset.model._meta.db_table]
+        env = dict(os.environ)
+        if connection.settings_dict['PASSWORD']:
+            env['PGPASSWORD'] = connection.settings_dict['PASSWORD']
+        try:
+            subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise ExportUnavailable('ogr2ogr could not write {}: {}'.format(file_format, getattr(e, 'stderr', None) or e))
+
+    @list_route()
+    def export(self, request):
+        file_format = request.query_params.get('file_format', 'csv')
+        has_geometry = any(isinstance(f, GeometryField) for f in self.get_export_fields())
+        if file_format not in EXPORT_CONTENT_TYPES or (file_format in OGR_DRIVERS and not has_geometry):
+            raise ParseError('Invalid file_format {}'.format(file_format))
+
+        cache = self.get_export_cache()
+        path = cache.path('{}.{}'.format(query_digest(filter_params(self, request)), file_format))
+        if not os.path.isfile(path):
+            queryset = self.filter_queryset(self.get_queryset())
+            if file_format == 'csv':
+                cache.write(path, lambda tmp_path: self.write_csv(queryset, tmp_path))
+            elif file_format == 'parquet':
+                cache.write(path, lambda tmp_path: self.write_parquet(queryset, tmp_path))
+            else:
+                cache.write(path, lambda tmp_path: self.write_ogr(queryset, tmp_path, file_format))
+
+        response = FileResponse(open(path, 'rb'), content_type=EXPORT_CONTENT_TYPES[file_format])
+        response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(self.queryset.model._meta.db_table, file_format)
+        return response
@@ -0,0 +1,55 @@
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db import transaction
+from django.db.models import Q
+from api.models import DatasetVersion, FacetCatalog
+
+
+class SortedDistinctArrayAgg(ArrayAgg):
+    """
+    array_agg of the distinct values of a column in ascending order, since ArrayAgg has no ordering in Django 2.0.
+    The column is repeated in ORDER BY, so the expression must be a plain field without parameters.
+    """
+    template = '%(function)s(DISTINCT %(expressions)s ORDER BY %(expressions)s)'
+
+def facet_values(queryset, fields):
+    """
+    Returns a dict of field name to the sorted distinct values of that field in queryset, computed with a single
+    aggregate query rather than one DISTINCT query per field.
+    """
+    aggregates = {'facet_' + f: SortedDistinctArrayAgg(f, filter=Q(**{f + '__isnull': False})) for f in fields}
+    result = queryset.order_by().aggregate(**aggregates)
+    return {f: result['facet_' + f] or [] for f in fields}
+
+def catalog_values(model, fields):
+    """
+    Returns the precomputed values of fields for the whole of model's table from FacetCatalog, or None if any of
+    them hasn't been built.
+    """
+    catalog = dict(FacetCatalog.objects.filter(dataset=model._meta.db_table, field__in=fields).values_list('field', 'values'))
+    if any(f not in catalog for f in fields):
+        return None
+    return catalog
+
+def build_catalog(model, fields, queryset=None, extra_values=None):
+    """
+    Stores the distinct values of fields for model's table in FacetCatalog. Loaders run this after loading so
+    that unfiltered meta requests are answered from the catalog. The version of model's dataset is bumped, so that
+    only the responses cached from this dataset are invalidated.
+
+    Parameters:
+        model: Django model the values come from
+        fields: list of field names to catalog
+        queryset: optional queryset to take the values from instead of all of model's rows
+        extra_values: optional dict of facet name to list of values computed some other way, e.g. combined fields
+    """
+    if queryset is None:
+        queryset = model.objects.all()
+    values = facet_values(queryset, fields)
+    if extra_values:
+        values.update(extra_values)
+
+    dataset = model._meta.db_table
+    with transaction.atomic():
+        FacetCatalog.objects.filter(dataset=dataset).delete()
+        FacetCatalog.objects.bulk_create(FacetCatalog(dataset=dataset, field=f, values=[str(v) for v in values[f]]) for f in values)
+    DatasetVersion.objects.bump(model)
@@ -0,0 +1,93 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from django.utils.http import urlencode
+
+def normalized_query(params):
+    """
+    Returns params, a QueryDict or list of (key, values) pairs, as a query string with the keys and values sorted so
+    that equivalent requests share a cache key.
+    """
+    if hasattr(params, 'lists'):
+        params = params.lists()
+    return urlencode(sorted((k, sorted(v)) for k, v in params), doseq=True)
+
+def query_digest(params):
+    return hashlib.md5(normalized_query(params).encode('utf-8')).hexdigest()
+
+# attributes naming the query parameter read by the filter backends that are not FilterSets
+FILTER_BACKEND_PARAMS = ('bbox_param', 'within_distance_param')
+
+def filter_params(view, request):
+    """
+    Returns the query parameters of request that the view's filters read, as (key, values) pairs with the values of
+    the filterset cleaned, so that unknown parameters and other spellings of the same filter share a cache key.
+    """
+    params = []
+    filter_class = getattr(view, 'filter_class', None)
+    if filter_class is not None:
+        filterset = filter_class(request.query_params, queryset=view.get_queryset(), request=request)
+        if filterset.is_valid():
+            params += [(name, [str(value)]) for name, value in filterset.form.cleaned_data.items() if value not in (None, '', [])]
+        else:
+            # invalid filters match no rows whatever their values
+            params.append(('invalid', sorted(filterset.form.errors)))
+
+    names = [getattr(b, a) for b in view.filter_backends for a in FILTER_BACKEND_PARAMS if getattr(b, a, None)]
+    params += [(name, request.query_params.getlist(name)) for name in names if name in request.query_params]
+    return params
+
+class VersionedFileCache(object):
+    """
+    Files generated from a dataset, stored under root/name/version. When a new version of the dataset is loaded the
+    files of the older versions are deleted, since they will never be served again.
+
+    Parameters:
+        root: directory the cache is stored in, e.g. settings.TILE_CACHE_DIR
+        name: name of the cached dataset or layer
+        version: load version of the dataset from DatasetVersion
+        max_files: number of files kept directly in the version directory, the least recently written are deleted
+    """
+    def __init__(self, root, name, version, max_files=None):
+        self.name_dir = os.path.join(root, name)
+        self.version_dir = os.path.join(self.name_dir, str(version))
+        self.max_files = max_files
+
+        if os.path.isdir(self.name_dir) and not os.path.isdir(self.version_dir):
+            for old in os.listdir(self.name_dir):
+                shutil.rmtree(os.path.join(self.name_dir, old), ignore_errors=True)
+
+    def path(self, *parts):
+        return os.path.join(self.version_dir, *parts)
+
+    def write(self, path, writer):
+        """
+        Generates the file at path by calling writer with a temporary path in the same directory, then moves it into
+        place so that concurrent requests never read a partial file.
+        """
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=directory)
+        try:
+            tmp_path = os.path.join(tmp_dir, os.path.basename(path))
+            writer(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        if self.max_files is not None:
+            self.evict()
+
+    def evict(self):
+        files = []
+        for entry in os.scandir(self.version_dir):
+            if entry.is_file():
+                try:
+                    files.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    continue
+        for mtime, path in sorted(files)[:max(len(files) - self.max_files, 0)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,80 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_taxlotdata_year'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jchsdata',
+            name='asc_rank',
+            field=models.PositiveIntegerField(blank=True, help_text='Rank of value in ascending order', null=True),
+        ),
+        migrations.AddField(
+            model_name='jchsdata',
+            name='desc_rank',
+            field=models.PositiveIntegerField(blank=True, help_text='Rank of value in descending order', null=True),
+        ),
+        migrations.AddField(
+            model_name='jchsdata',
+            name='total',
+            field=models.PositiveIntegerField(blank=True, help_text='Number of ranked values', null=True),
+        ),
+        migrations.AddField(
+            model_name='hudpitdata',
+            name='rank',
+            field=models.PositiveIntegerField(blank=True, help_text='Rank of value in ascending order', null=True),
+        ),
+        migrations.AddField(
+            model_name='hudpitdata',
+            name='total',
+            field=models.PositiveIntegerField(blank=True, help_text='Number of ranked values', null=True),
+        ),
+        migrations.AddField(
+            model_name='urbaninstituterentalcrisisdata',
+            name='rank',
+            field=models.PositiveIntegerField(blank=True, help_text='Rank of affordable, adequate, and available units per ELI renter in descending order', null=True),
+        ),
+        migrations.AddField(
+            model_name='urbaninstituterentalcrisisdata',
+            name='total',
+            field=models.PositiveIntegerField(blank=True, help_text='Number of ranked values', null=True),
+        ),
+        # rank existing rows, later loads refresh these through RankManager.refresh_rank
+        migrations.RunSQL(
+            '''
+            UPDATE api_jchsdata SET asc_rank = ranked.asc_rank, desc_rank = ranked.desc_rank, total = ranked.total
+            FROM (
+                SELECT id,
+                    RANK() OVER (PARTITION BY datatype, source, date ORDER BY value ASC) AS asc_rank,
+                    RANK() OVER (PARTITION BY datatype, source, date ORDER BY value DESC) AS desc_rank,
+                    COUNT(*) OVER (PARTITION BY datatype, source, date) AS total
+                FROM api_jchsdata
+                WHERE datapoint <> 'United States'
+            ) AS ranked
+            WHERE api_jchsdata.id = ranked.id;
+
+            UPDATE api_hudpitdata SET rank = ranked.rank, total = ranked.total
+            FROM (
+                SELECT id,
+                    RANK() OVER (PARTITION BY datatype, geography, year ORDER BY value ASC) AS rank,
+                    COUNT(*) OVER (PARTITION BY datatype, geography, year) AS total
+                FROM api_hudpitdata
+            ) AS ranked
+            WHERE api_hudpitdata.id = ranked.id;
+
+            UPDATE api_urbaninstituterentalcrisisdata SET rank = ranked.rank, total = ranked.total
+            FROM (
+                SELECT id,
+                    RANK() OVER (PARTITION BY year ORDER BY aaa_units / eli_renters DESC) AS rank,
+                    COUNT(*) OVER (PARTITION BY year) AS total
+                FROM api_urbaninstituterentalcrisisdata
+            ) AS ranked
+            WHERE api_urbaninstituterentalcrisisdata.id = ranked.id;
+            ''',
+            migrations.RunSQL.noop,
+        ),
+    ]
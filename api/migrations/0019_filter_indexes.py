@@ -0,0 +1,38 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_stored_ranks'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='jchsdata',
+            index=models.Index(fields=['datatype', 'source', 'date', 'value'], name='api_jchsdata_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hudpitdata',
+            index=models.Index(fields=['datatype', 'geography', 'year', 'value'], name='api_hudpitdata_rank_idx'),
+        ),
+        # icontains and iexact lookups compare UPPER(column::text), so the indexes are built on that expression
+        migrations.RunSQL(
+            [
+                'CREATE INDEX api_jchsdata_datatype_clean_trgm ON api_jchsdata USING gin (UPPER(datatype_clean::text) gin_trgm_ops);',
+                'CREATE INDEX api_jchsdata_datapoint_clean_trgm ON api_jchsdata USING gin (UPPER(datapoint_clean::text) gin_trgm_ops);',
+                'CREATE INDEX api_jchsdata_valuetype_clean_trgm ON api_jchsdata USING gin (UPPER(valuetype_clean::text) gin_trgm_ops);',
+                'CREATE INDEX api_jchsdata_source_upper ON api_jchsdata (UPPER(source::text));',
+                'CREATE INDEX api_hudpitdata_geography_upper ON api_hudpitdata (UPPER(geography::text));',
+            ],
+            [
+                'DROP INDEX api_jchsdata_datatype_clean_trgm;',
+                'DROP INDEX api_jchsdata_datapoint_clean_trgm;',
+                'DROP INDEX api_jchsdata_valuetype_clean_trgm;',
+                'DROP INDEX api_jchsdata_source_upper;',
+                'DROP INDEX api_hudpitdata_geography_upper;',
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetVersion',
+            fields=[
+                ('dataset', models.CharField(help_text='Database table the data is loaded into', max_length=255, primary_key=True, serialize=False)),
+                ('version', models.PositiveIntegerField(default=0, help_text='Incremented every time the data is reloaded')),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_datasetversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasetversion',
+            name='loaded_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text='Time the data was last reloaded'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_datasetversion_loaded_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCatalog',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dataset', models.CharField(help_text='Database table the values come from', max_length=255)),
+                ('field', models.CharField(help_text='Field the values come from', max_length=255)),
+                ('values', django.contrib.postgres.fields.ArrayField(base_field=models.TextField(), help_text='Sorted distinct values of the field', size=None)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='facetcatalog',
+            unique_together={('dataset', 'field')},
+        ),
+    ]
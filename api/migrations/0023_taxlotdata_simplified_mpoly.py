@@ -0,0 +1,31 @@
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_facetcatalog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taxlotdata',
+            name='mpoly_low',
+            field=django.contrib.gis.db.models.fields.MultiPolygonField(blank=True, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='taxlotdata',
+            name='mpoly_mid',
+            field=django.contrib.gis.db.models.fields.MultiPolygonField(blank=True, null=True, srid=4326),
+        ),
+        # simplify taxlots that are already loaded, same as TaxlotData.objects.simplify()
+        migrations.RunSQL(
+            '''
+            UPDATE api_taxlotdata SET
+                mpoly_low = ST_Multi(ST_SnapToGrid(ST_SimplifyPreserveTopology(mpoly, 0.0003), 0.000075)),
+                mpoly_mid = ST_Multi(ST_SnapToGrid(ST_SimplifyPreserveTopology(mpoly, 0.00004), 0.00001));
+            ''',
+            migrations.RunSQL.noop,
+        ),
+    ]
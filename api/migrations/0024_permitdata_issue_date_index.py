@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_taxlotdata_simplified_mpoly'),
+    ]
+
+    operations = [
+        # leads with issue_date for the date range filters, and orders keyset pages
+        migrations.AddIndex(
+            model_name='permitdata',
+            index=models.Index(fields=['issue_date', 'id'], name='api_permitdata_keyset_idx'),
+        ),
+    ]
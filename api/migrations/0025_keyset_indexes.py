@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0024_permitdata_issue_date_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='taxlotdata',
+            index=models.Index(fields=['year', 'id'], name='api_taxlotdata_keyset_idx'),
+        ),
+    ]
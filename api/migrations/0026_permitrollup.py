@@ -0,0 +1,34 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0025_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PermitRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('neighborhood', models.CharField(max_length=255)),
+                ('new_class', models.CharField(max_length=255)),
+                ('is_adu', models.CharField(max_length=5)),
+                ('permit_count', models.PositiveIntegerField(help_text='Number of permits')),
+                ('new_units', models.IntegerField(help_text='Total new units of the permits')),
+                ('valuation', models.DecimalField(decimal_places=2, help_text='Total valuation of the permits', max_digits=19)),
+            ],
+        ),
+        # build the rollup of permits that are already loaded, same as PermitRollup.objects.refresh()
+        migrations.RunSQL(
+            '''
+            INSERT INTO api_permitrollup (year, neighborhood, new_class, is_adu, permit_count, new_units, valuation)
+            SELECT year, neighborhood, new_class, is_adu, COUNT(*), SUM(new_units), SUM(valuation)
+            FROM api_permitdata
+            GROUP BY year, neighborhood, new_class, is_adu;
+            ''',
+            migrations.RunSQL.noop,
+        ),
+    ]
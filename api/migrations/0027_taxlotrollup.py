@@ -0,0 +1,57 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0026_permitrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaxlotRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('geography', models.CharField(help_text='city or grid', max_length=10)),
+                ('cell_x', models.IntegerField(blank=True, help_text='Grid cell column, the cell spans cell_x * TAXLOT_ROLLUP_GRID_SIZE degrees of longitude onwards', null=True)),
+                ('cell_y', models.IntegerField(blank=True, help_text='Grid cell row, the cell spans cell_y * TAXLOT_ROLLUP_GRID_SIZE degrees of latitude onwards', null=True)),
+                ('metric', models.CharField(help_text='Taxlot field summarized', max_length=20)),
+                ('lot_count', models.PositiveIntegerField(help_text='Number of taxlots with a value')),
+                ('p25', models.FloatField(blank=True, null=True)),
+                ('median', models.FloatField(blank=True, null=True)),
+                ('p75', models.FloatField(blank=True, null=True)),
+                ('mean', models.FloatField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='taxlotrollup',
+            index=models.Index(fields=['geography', 'metric', 'year'], name='api_taxlotrollup_lookup_idx'),
+        ),
+        # roll up taxlots that are already loaded, same as TaxlotRollup.objects.refresh() for every year
+        migrations.RunSQL(
+            '''
+            INSERT INTO api_taxlotrollup (year, geography, cell_x, cell_y, metric, lot_count, p25, median, p75, mean)
+            SELECT t.year, g.geography, g.cell_x, g.cell_y, m.metric, COUNT(m.value),
+                percentile_cont(0.25) WITHIN GROUP (ORDER BY m.value),
+                percentile_cont(0.5) WITHIN GROUP (ORDER BY m.value),
+                percentile_cont(0.75) WITHIN GROUP (ORDER BY m.value),
+                AVG(m.value)
+            FROM api_taxlotdata AS t
+            CROSS JOIN LATERAL ST_PointOnSurface(t.mpoly) AS c
+            CROSS JOIN LATERAL (VALUES
+                ('city', NULL::int, NULL::int),
+                ('grid', floor(ST_X(c) / 0.01)::int, floor(ST_Y(c) / 0.01)::int)
+            ) AS g(geography, cell_x, cell_y)
+            CROSS JOIN LATERAL (VALUES
+                ('land_value', t.land_value::float8),
+                ('building_value', t.building_value::float8),
+                ('total_value', t.total_value::float8),
+                ('sale_price', NULLIF(t.sale_price, 0)::float8),
+                ('percent_change', t.percent_change::float8)
+            ) AS m(metric, value)
+            GROUP BY t.year, g.geography, g.cell_x, g.cell_y, m.metric;
+            ''',
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0027_taxlotrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoadManifest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dataset', models.CharField(help_text='Database table the data is loaded into', max_length=255)),
+                ('partition', models.CharField(help_text='Source file, or part of one, that is loaded as a unit', max_length=255)),
+                ('content_hash', models.CharField(help_text='SHA-256 of the source content last loaded', max_length=64)),
+                ('loaded_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Time the partition was last loaded')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='loadmanifest',
+            unique_together={('dataset', 'partition')},
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0028_loadmanifest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loadmanifest',
+            name='loader_version',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Version of the loader that loaded the partition'),
+        ),
+    ]
@@ -1,14 +1,74 @@
-from django.db.models.functions import Rank
+from django.db.models.functions import Concat, Lower, Rank
 from django.contrib.postgres.fields import ArrayField
 from django.contrib.gis.db import models
+from django.db import connections, transaction
+from django.utils import timezone
 from autoslug import AutoSlugField
 
-class JCHSDataManager(models.Manager):
+class RankManager(models.Manager):
+    """
+    Manager for models that store their ranks in columns so that ranked list requests don't need to recompute
+    window functions over the whole table. Child classes define rank_fields and compute_rank, which annotates
+    each rank field prefixed with 'computed_'.
+    """
+    rank_fields = ()
+    # rows left out of the ranking entirely, their rank fields are set to NULL
+    exclude_from_rank = None
+
+    def compute_rank(self):
+        raise NotImplementedError("compute_rank must be implemented by child class.")
+
     def with_rank(self):
-        ranked = JCHSData.objects.exclude(datapoint='United States').annotate(
-            asc_rank=models.Window(expression=Rank(), partition_by=[models.F('datatype'),models.F('source'),models.F('date')], order_by=models.F('value').asc()),
-            desc_rank=models.Window(expression=Rank(), partition_by=[models.F('datatype'),models.F('source'),models.F('date')], order_by=models.F('value').desc()),
-            total=models.Window(expression=models.Count(['datatype','source','date']), partition_by=[models.F('datatype'),models.F('source'),models.F('date')])
+        return self.get_queryset()
+
+    def refresh_rank(self):
+        """
+        Recomputes the stored rank fields from compute_rank. Should be run after data for the model is loaded.
+
+        Returns: Number of rows whose ranks changed.
+        """
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        pk = qn(self.model._meta.pk.column)
+
+        ranked = self.compute_rank().values('pk', *['computed_' + f for f in self.rank_fields])
+        ranked_sql, ranked_params = ranked.query.sql_with_params()
+        columns = [(qn(self.model._meta.get_field(f).column), qn('computed_' + f)) for f in self.rank_fields]
+
+        # only touch rows whose ranks actually changed
+        sql = '''
+            UPDATE {table} SET {sets}
+            FROM ({ranked}) AS ranked
+            WHERE {table}.{pk} = ranked.{pk} AND ({changed})
+        '''.format(
+            table=table,
+            pk=pk,
+            ranked=ranked_sql,
+            sets=', '.join('{} = ranked.{}'.format(c, rc) for c, rc in columns),
+            changed=' OR '.join('{}.{} IS DISTINCT FROM ranked.{}'.format(table, c, rc) for c, rc in columns),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, ranked_params)
+            ct = cursor.rowcount
+
+        if self.exclude_from_rank is not None:
+            unranked = self.filter(self.exclude_from_rank).exclude(**{f: None for f in self.rank_fields})
+            ct += unranked.update(**{f: None for f in self.rank_fields})
+
+        if ct:
+            DatasetVersion.objects.bump(self.model)
+        return ct
+
+class JCHSDataManager(RankManager):
+    rank_fields = ('asc_rank', 'desc_rank', 'total')
+    exclude_from_rank = models.Q(datapoint='United States')
+
+    def compute_rank(self):
+        ranked = self.exclude(self.exclude_from_rank).annotate(
+            computed_asc_rank=models.Window(expression=Rank(), partition_by=[models.F('datatype'),models.F('source'),models.F('date')], order_by=models.F('value').asc()),
+            computed_desc_rank=models.Window(expression=Rank(), partition_by=[models.F('datatype'),models.F('source'),models.F('date')], order_by=models.F('value').desc()),
+            computed_total=models.Window(expression=models.Count(['datatype','source','date']), partition_by=[models.F('datatype'),models.F('source'),models.F('date')])
         )
         return ranked
 
@@ -25,13 +85,26 @@ class JCHSData(models.Model):
     datatype_clean = AutoSlugField(populate_from='datatype', max_length=100)
     valuetype_clean = AutoSlugField(populate_from='valuetype', max_length=100)
 
+    # ranks within datatype, source and date, refreshed by JCHSData.objects.refresh_rank() after each load
+    asc_rank = models.PositiveIntegerField(null=True, blank=True, help_text='Rank of value in ascending order')
+    desc_rank = models.PositiveIntegerField(null=True, blank=True, help_text='Rank of value in descending order')
+    total = models.PositiveIntegerField(null=True, blank=True, help_text='Number of ranked values')
+
     objects = JCHSDataManager()
 
-class HudPitDataManager(models.Manager):
-    def with_rank(self):
-        ranked = HudPitData.objects.annotate(
-            rank=models.Window(expression=Rank(), partition_by=[models.F('datatype'),models.F('geography'),models.F('year')], order_by=models.F('value').asc()),
-            total=models.Window(expression=models.Count(['datatype','geography','year']), partition_by=[models.F('datatype'),models.F('geography'),models.F('year')])
+    class Meta:
+        indexes = [
+            # matches the partitions and ordering of the rank windows
+            models.Index(fields=['datatype', 'source', 'date', 'value'], name='api_jchsdata_rank_idx'),
+        ]
+
+class HudPitDataManager(RankManager):
+    rank_fields = ('rank', 'total')
+
+    def compute_rank(self):
+        ranked = self.annotate(
+            computed_rank=models.Window(expression=Rank(), partition_by=[models.F('datatype'),models.F('geography'),models.F('year')], order_by=models.F('value').asc()),
+            computed_total=models.Window(expression=models.Count(['datatype','geography','year']), partition_by=[models.F('datatype'),models.F('geography'),models.F('year')])
         )
         return ranked
 
@@ -46,8 +119,18 @@ class HudPitData(models.Model):
     datapoint_clean = AutoSlugField(populate_from='datapoint', max_length=100)
     datatype_clean = AutoSlugField(populate_from='datatype', max_length=100)
 
+    # ranks within datatype, geography and year, refreshed by HudPitData.objects.refresh_rank() after each load
+    rank = models.PositiveIntegerField(null=True, blank=True, help_text='Rank of value in ascending order')
+    total = models.PositiveIntegerField(null=True, blank=True, help_text='Number of ranked values')
+
     objects = HudPitDataManager()
 
+    class Meta:
+        indexes = [
+            # matches the partitions and ordering of the rank window
+            models.Index(fields=['datatype', 'geography', 'year', 'value'], name='api_hudpitdata_rank_idx'),
+        ]
+
 class HudHicData(models.Model):
     datapoint = models.CharField(max_length=255, help_text='Location of data')
     geography = models.CharField(max_length=255, help_text='Location type')
@@ -62,14 +145,28 @@ class HudHicData(models.Model):
     datapoint_clean = AutoSlugField(populate_from='datapoint', max_length=100)
     datatype_clean = AutoSlugField(populate_from='datatype', max_length=100)
 
-class UrbanInstituteRentalCrisisManager(models.Manager):
-    def with_rank(self):
-        ranked = UrbanInstituteRentalCrisisData.objects.annotate(
-            rank=models.Window(expression=Rank(), partition_by=[models.F('year')], order_by=(models.F('aaa_units')/models.F('eli_renters')).desc()),
-            total=models.Window(expression=models.Count(['year']), partition_by=[models.F('year')])
+class UrbanInstituteRentalCrisisManager(RankManager):
+    rank_fields = ('rank', 'total')
+
+    def compute_rank(self):
+        ranked = self.annotate(
+            computed_rank=models.Window(expression=Rank(), partition_by=[models.F('year')], order_by=(models.F('aaa_units')/models.F('eli_renters')).desc()),
+            computed_total=models.Window(expression=models.Count(['year']), partition_by=[models.F('year')])
         )
         
         return ranked
+
+    def geographies(self):
+        """
+        Returns the distinct "county, state" names, deduplicated case-insensitively in the database and ordered by state then county.
+        """
+        geography = Concat('county_name', models.Value(', '), 'state_name', output_field=models.CharField())
+        qs = self.values(key=Lower(geography)).annotate(
+            geography=models.Max(geography),
+            state=models.Min('state_name'),
+            county=models.Min('county_name'),
+        ).order_by('state', 'county')
+        return [row['geography'] for row in qs]
     
 class UrbanInstituteRentalCrisisData(models.Model):
     year = models.PositiveSmallIntegerField(help_text='Year of data')
@@ -86,6 +183,10 @@ class UrbanInstituteRentalCrisisData(models.Model):
     no_hud_units = models.DecimalField(max_digits=11, decimal_places=2, help_text='Number of affordable, adequate, and available units without HUD rental assistance')
     no_usda_units = models.DecimalField(max_digits=11, decimal_places=2, help_text='Number of affordable, adequate, and available units without USDA rental assistance')
 
+    # ranks of affordable units per ELI renter within year, refreshed by UrbanInstituteRentalCrisisData.objects.refresh_rank() after each load
+    rank = models.PositiveIntegerField(null=True, blank=True, help_text='Rank of affordable, adequate, and available units per ELI renter in descending order')
+    total = models.PositiveIntegerField(null=True, blank=True, help_text='Number of ranked values')
+
     objects = UrbanInstituteRentalCrisisManager()
 
     def aaa_units_per_100(self):
@@ -168,6 +269,76 @@ class PermitData(models.Model):
 
     point = models.PointField()
 
+    class Meta:
+        indexes = [
+            # keyset pagination order, also serves issue_date range filters
+            models.Index(fields=['issue_date', 'id'], name='api_permitdata_keyset_idx'),
+        ]
+
+# dimensions permit summaries can be grouped by and the rollup is aggregated over
+PERMIT_SUMMARY_DIMENSIONS = ('year', 'neighborhood', 'new_class', 'is_adu')
+
+class PermitRollupManager(models.Manager):
+    def refresh(self):
+        """
+        Rebuilds the rollup from PermitData. Should be run after permits are loaded.
+        """
+        rows = (PermitData.objects.order_by()
+            .values(*PERMIT_SUMMARY_DIMENSIONS)
+            .annotate(permit_count=models.Count('pk'), new_units=models.Sum('new_units'), valuation=models.Sum('valuation')))
+        with transaction.atomic():
+            self.all().delete()
+            self.bulk_create(PermitRollup(**row) for row in rows)
+        DatasetVersion.objects.bump(self.model)
+
+class PermitRollup(models.Model):
+    year = models.PositiveSmallIntegerField()
+    neighborhood = models.CharField(max_length=255)
+    new_class = models.CharField(max_length=255)
+    is_adu = models.CharField(max_length=5)
+    permit_count = models.PositiveIntegerField(help_text='Number of permits')
+    new_units = models.IntegerField(help_text='Total new units of the permits')
+    valuation = models.DecimalField(max_digits=19, decimal_places=2, help_text='Total valuation of the permits')
+
+    objects = PermitRollupManager()
+
+# zoom bands the taxlots endpoint serves simplified geometries for, as
+# (highest zoom level of the band, field, simplification tolerance in degrees). Zoom levels above the last band get
+# the full resolution mpoly. The tolerances are about half a 256px tile pixel at the band's highest zoom level.
+TAXLOT_ZOOM_BANDS = [
+    (11, 'mpoly_low', 0.0003),
+    (14, 'mpoly_mid', 0.00004),
+]
+
+class TaxlotDataManager(models.Manager):
+    # computed from mpoly by simplify
+    derived_fields = tuple(field for max_zoom, field, tolerance in TAXLOT_ZOOM_BANDS)
+
+    def simplify(self, year=None, missing=False):
+        """
+        Precomputes the simplified geometry of each zoom band in TAXLOT_ZOOM_BANDS from mpoly. Should be run after data for the year is loaded.
+
+        Parameters:
+            year: only simplify taxlots of this year, defaults to all years
+            missing: only simplify taxlots that have no simplified geometry yet, e.g. those inserted by a diff load
+        """
+        qs = self.all() if year is None else self.filter(year=year)
+        if missing:
+            qs = qs.filter(**{self.derived_fields[0] + '__isnull': True})
+        for max_zoom, field, tolerance in TAXLOT_ZOOM_BANDS:
+            simplified = models.Func(models.F('mpoly'), models.Value(tolerance), function='ST_SimplifyPreserveTopology')
+            snapped = models.Func(simplified, models.Value(tolerance / 4), function='ST_SnapToGrid')
+            qs.update(**{field: models.Func(snapped, function='ST_Multi', output_field=models.MultiPolygonField())})
+
+    def zoom_field(self, zoom):
+        """
+        Returns the name of the geometry field to use for a map zoom level.
+        """
+        for max_zoom, field, tolerance in TAXLOT_ZOOM_BANDS:
+            if zoom <= max_zoom:
+                return field
+        return 'mpoly'
+
 class TaxlotData(models.Model):
     year = models.PositiveSmallIntegerField()
     area = models.FloatField()
@@ -203,4 +374,167 @@ class TaxlotData(models.Model):
     percent_change = models.FloatField()
 
     mpoly = models.MultiPolygonField()
+    # simplified copies of mpoly for low zoom levels, see TAXLOT_ZOOM_BANDS
+    mpoly_low = models.MultiPolygonField(null=True, blank=True)
+    mpoly_mid = models.MultiPolygonField(null=True, blank=True)
+
+    objects = TaxlotDataManager()
+
+    class Meta:
+        indexes = [
+            # keyset pagination order
+            models.Index(fields=['year', 'id'], name='api_taxlotdata_keyset_idx'),
+        ]
+
+
+# value fields of taxlots summarized by the rollup
+TAXLOT_ROLLUP_METRICS = ('land_value', 'building_value', 'total_value', 'sale_price', 'percent_change')
+# size in degrees of the grid cells taxlots are rolled up into, about 1km
+TAXLOT_ROLLUP_GRID_SIZE = 0.01
+
+class TaxlotRollupManager(models.Manager):
+    def refresh(self, year):
+        """
+        Recomputes the rollups of a year of taxlots: the count, quartiles and mean of every metric in
+        TAXLOT_ROLLUP_METRICS, for the whole city and for every grid cell of TAXLOT_ROLLUP_GRID_SIZE. Taxlots belong to
+        the cell of a point on their surface. Sale prices of 0 are treated as no sale. Should be run after data for the
+        year is loaded.
+        """
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        metrics = ', '.join(
+            "('{0}', {1}::float8)".format(m, 'NULLIF(t.sale_price, 0)' if m == 'sale_price' else 't.' + qn(m))
+            for m in TAXLOT_ROLLUP_METRICS
+        )
+        sql = '''
+            INSERT INTO {rollup} (year, geography, cell_x, cell_y, metric, lot_count, p25, median, p75, mean)
+            SELECT t.year, g.geography, g.cell_x, g.cell_y, m.metric, COUNT(m.value),
+                percentile_cont(0.25) WITHIN GROUP (ORDER BY m.value),
+                percentile_cont(0.5) WITHIN GROUP (ORDER BY m.value),
+                percentile_cont(0.75) WITHIN GROUP (ORDER BY m.value),
+                AVG(m.value)
+            FROM {taxlots} AS t
+            CROSS JOIN LATERAL ST_PointOnSurface(t.mpoly) AS c
+            CROSS JOIN LATERAL (VALUES
+                ('city', NULL::int, NULL::int),
+                ('grid', floor(ST_X(c) / %s)::int, floor(ST_Y(c) / %s)::int)
+            ) AS g(geography, cell_x, cell_y)
+            CROSS JOIN LATERAL (VALUES {metrics}) AS m(metric, value)
+            WHERE t.year = %s
+            GROUP BY t.year, g.geography, g.cell_x, g.cell_y, m.metric
+        '''.format(
+            rollup=qn(self.model._meta.db_table),
+            taxlots=qn(TaxlotData._meta.db_table),
+            metrics=metrics,
+        )
+        with transaction.atomic(using=self.db):
+            self.filter(year=year).delete()
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [TAXLOT_ROLLUP_GRID_SIZE, TAXLOT_ROLLUP_GRID_SIZE, year])
+        DatasetVersion.objects.bump(self.model)
+
+class TaxlotRollup(models.Model):
+    year = models.PositiveSmallIntegerField()
+    geography = models.CharField(max_length=10, help_text='city or grid')
+    cell_x = models.IntegerField(null=True, blank=True, help_text='Grid cell column, the cell spans cell_x * TAXLOT_ROLLUP_GRID_SIZE degrees of longitude onwards')
+    cell_y = models.IntegerField(null=True, blank=True, help_text='Grid cell row, the cell spans cell_y * TAXLOT_ROLLUP_GRID_SIZE degrees of latitude onwards')
+    metric = models.CharField(max_length=20, help_text='Taxlot field summarized')
+    lot_count = models.PositiveIntegerField(help_text='Number of taxlots with a value')
+    p25 = models.FloatField(null=True, blank=True)
+    median = models.FloatField(null=True, blank=True)
+    p75 = models.FloatField(null=True, blank=True)
+    mean = models.FloatField(null=True, blank=True)
+
+    objects = TaxlotRollupManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['geography', 'metric', 'year'], name='api_taxlotrollup_lookup_idx'),
+        ]
+
+class DatasetVersionManager(models.Manager):
+    def bump(self, model):
+        """
+        Increments the version of the dataset stored in model's table and records the load time. Loaders call this whenever they write to the table so that anything cached from it is invalidated.
+        """
+        dataset = model._meta.db_table
+        now = timezone.now()
+        if not self.filter(dataset=dataset).update(version=models.F('version') + 1, loaded_at=now):
+            self.get_or_create(dataset=dataset, defaults={'version': 1, 'loaded_at': now})
+
+    def load_info(self, *model_classes):
+        """
+        Returns a dict of table name to version for the given models and the time the most recent of them was loaded. Datasets that have never been loaded have version 0.
+        """
+        datasets = [m._meta.db_table for m in model_classes]
+        versions = dict.fromkeys(datasets, 0)
+        last_loaded = None
+        for dataset, version, loaded_at in self.filter(dataset__in=datasets).values_list('dataset', 'version', 'loaded_at'):
+            versions[dataset] = version
+            if last_loaded is None or loaded_at > last_loaded:
+                last_loaded = loaded_at
+        return versions, last_loaded
+
+class DatasetVersion(models.Model):
+    dataset = models.CharField(max_length=255, primary_key=True, help_text='Database table the data is loaded into')
+    version = models.PositiveIntegerField(default=0, help_text='Incremented every time the data is reloaded')
+    loaded_at = models.DateTimeField(default=timezone.now, help_text='Time the data was last reloaded')
+
+    objects = DatasetVersionManager()
+
+class FacetCatalog(models.Model):
+    dataset = models.CharField(max_length=255, help_text='Database table the values come from')
+    field = models.CharField(max_length=255, help_text='Field the values come from')
+    values = ArrayField(models.TextField(), help_text='Sorted distinct values of the field')
+
+    class Meta:
+        unique_together = ('dataset', 'field')
+
+class LoadManifestManager(models.Manager):
+    def changed(self, model, hashes, version=1):
+        """
+        Returns the partitions whose content differs from what was last loaded into model's table, or that were
+        loaded by another version of the loader.
+
+        Returns: Dict of partition to content hash, for the partitions of hashes that are new or changed.
+
+        Parameters:
+            model: Django model the partitions are loaded into
+            hashes: dict of partition name to the content hash of its source
+            version: version of the loader, bumped when the way it parses or transforms its source changes
+        """
+        loaded = self.filter(dataset=model._meta.db_table, partition__in=list(hashes))
+        loaded = {p: (h, v) for p, h, v in loaded.values_list('partition', 'content_hash', 'loader_version')}
+        return {p: h for p, h in hashes.items() if loaded.get(p) != (h, version)}
+
+    def record(self, model, hashes, version=1, replace=False):
+        """
+        Records the content hashes of the partitions loaded into model's table. Loaders call this once the load is
+        committed, so that a failed load is retried on the next run.
+
+        Parameters:
+            model: Django model the partitions were loaded into
+            hashes: dict of partition name to the content hash of its source
+            version: version of the loader that loaded them
+            replace: forget the partitions not in hashes, for full reloads
+        """
+        dataset = model._meta.db_table
+        now = timezone.now()
+        with transaction.atomic(using=self.db):
+            if replace:
+                self.filter(dataset=dataset).exclude(partition__in=list(hashes)).delete()
+            for partition, content_hash in hashes.items():
+                defaults = {'content_hash': content_hash, 'loader_version': version, 'loaded_at': now}
+                self.update_or_create(dataset=dataset, partition=partition, defaults=defaults)
+
+class LoadManifest(models.Model):
+    dataset = models.CharField(max_length=255, help_text='Database table the data is loaded into')
+    partition = models.CharField(max_length=255, help_text='Source file, or part of one, that is loaded as a unit')
+    content_hash = models.CharField(max_length=64, help_text='SHA-256 of the source content last loaded')
+    loader_version = models.PositiveSmallIntegerField(default=1, help_text='Version of the loader that loaded the partition')
+    loaded_at = models.DateTimeField(default=timezone.now, help_text='Time the partition was last loaded')
+
+    objects = LoadManifestManager()
 
+    class Meta:
+        unique_together = ('dataset', 'partition')
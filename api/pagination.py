@@ -0,0 +1,112 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from datetime import date
+from django.core.exceptions import ValidationError
+from django.db import connections
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetLimitOffsetPagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination that can also page by keyset and skip the count.
+
+    When the cursor query parameter is given (empty for the first page), rows are ordered by the view's
+    keyset_ordering and each page starts after the last row of the previous one with a row comparison, so every
+    page is an index range scan however deep it is. The next link carries the cursor. With count=false the
+    COUNT(*) of the filtered queryset is skipped in either mode and count is returned as null.
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+
+        self.request = request
+        self.with_count = request.query_params.get(self.count_query_param, '').lower() != 'false'
+        self.keyset_ordering = getattr(view, 'keyset_ordering', None) if self.cursor_query_param in request.query_params else None
+        self.count = self.get_count(queryset) if self.with_count else None
+        if self.count is not None and self.count > self.limit and self.template is not None:
+            self.display_page_controls = True
+
+        if self.keyset_ordering:
+            self.offset = 0
+            queryset = self.filter_after_cursor(queryset.order_by(*self.keyset_ordering), request.query_params[self.cursor_query_param])
+        else:
+            self.offset = self.get_offset(request)
+            queryset = queryset[self.offset:]
+
+        # fetch one extra row to know if there is a next page without counting
+        page = list(queryset[:self.limit + 1])
+        self.has_next = len(page) > self.limit
+        page = page[:self.limit]
+        if self.keyset_ordering and page:
+            self.next_cursor = self.encode_cursor([getattr(page[-1], f) for f in self.keyset_ordering])
+        return page
+
+    def filter_after_cursor(self, queryset, cursor):
+        if not cursor:
+            return queryset
+        values = self.decode_cursor(cursor)
+        if len(values) != len(self.keyset_ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        opts = queryset.model._meta
+        connection = connections[queryset.db]
+        fields = [opts.get_field(f) for f in self.keyset_ordering]
+        # a tampered cursor would otherwise fail in the database with a DataError
+        try:
+            values = [f.get_db_prep_value(f.to_python(v), connection) for f, v in zip(fields, values)]
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if None in values:
+            raise NotFound(self.invalid_cursor_message)
+
+        qn = connection.ops.quote_name
+        columns = ['{}.{}'.format(qn(opts.db_table), qn(f.column)) for f in fields]
+        where = '({}) > ({})'.format(', '.join(columns), ', '.join(['%s'] * len(columns)))
+        return queryset.extra(where=[where], params=values)
+
+    def encode_cursor(self, values):
+        # isoformat keeps the microseconds that DRF's JSONEncoder would truncate
+        values = [v.isoformat() if isinstance(v, date) else v for v in values]
+        return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        if self.keyset_ordering:
+            return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+    def get_previous_link(self):
+        # keyset pages only go forward
+        if self.keyset_ordering:
+            return None
+        return super().get_previous_link()
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
@@ -0,0 +1,23 @@
+from django.db.models import Case, F, IntegerField, When
+
+
+def order_mapping_rank(order_mapping, order_keys, asc_field='asc_rank', desc_field='desc_rank'):
+    """
+    Returns a CASE expression that picks the descending rank for rows whose order_keys values are mapped to 'desc'
+    in order_mapping and the ascending rank for every other row.
+
+    Parameters:
+        order_mapping: dict of order_keys values (a tuple if order_keys is a tuple) to 'asc' or 'desc'
+        order_keys: field name or tuple of field names the order_mapping keys refer to
+        asc_field: name of the field holding the ascending rank
+        desc_field: name of the field holding the descending rank
+    """
+    if isinstance(order_keys, str):
+        order_keys = (order_keys,)
+        order_mapping = {(key,): order for key, order in order_mapping.items()}
+
+    whens = [
+        When(then=F(desc_field), **dict(zip(order_keys, key)))
+        for key, order in order_mapping.items() if order == 'desc'
+    ]
+    return Case(*whens, default=F(asc_field), output_field=IntegerField())
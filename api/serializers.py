@@ -52,3 +52,15 @@ class TaxlotDataSerializer(GeoFeatureModelSerializer):
         model = TaxlotData
         geo_field = 'mpoly'
         fields = ('year','percent_change',)
+
+class TaxlotDataLowZoomSerializer(GeoFeatureModelSerializer):
+    class Meta:
+        model = TaxlotData
+        geo_field = 'mpoly_low'
+        fields = ('year','percent_change',)
+
+class TaxlotDataMidZoomSerializer(GeoFeatureModelSerializer):
+    class Meta:
+        model = TaxlotData
+        geo_field = 'mpoly_mid'
+        fields = ('year','percent_change',)
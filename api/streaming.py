@@ -0,0 +1,118 @@
+from django.db import models
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+# number of rows fetched from the server-side cursor at a time
+STREAM_CHUNK_SIZE = 2000
+
+def json_property(field):
+    """
+    Returns an expression for the value of a model field in a GeoJSON feature built by PostGIS, formatted the same
+    way as the serializers format it.
+    """
+    if isinstance(field, models.DecimalField):
+        # DRF renders decimals as strings
+        return models.Func(models.F(field.name), template='%(expressions)s::text')
+    if isinstance(field, models.DateTimeField):
+        # like datetime.isoformat, the microseconds are only written when there are any
+        return models.Func(models.F(field.name), template=(
+            'to_char(%(expressions)s AT TIME ZONE \'UTC\', \'YYYY-MM-DD"T"HH24:MI:SS\') || '
+            'CASE WHEN date_trunc(\'second\', %(expressions)s) = %(expressions)s THEN \'\' '
+            'ELSE to_char(%(expressions)s AT TIME ZONE \'UTC\', \'.US\') END || \'Z\''
+        ))
+    if isinstance(field, models.DateField):
+        return models.Func(models.F(field.name), template='%(expressions)s::text')
+    return models.F(field.name)
+
+def json_object(pairs):
+    arguments = []
+    for key, value in pairs:
+        arguments += [models.Value(key), value]
+    return models.Func(*arguments, function='json_build_object', output_field=models.TextField())
+
+def geojson_feature(model, geo_field, fields, id_field=None):
+    """
+    Returns an expression for the GeoJSON Feature text of a row, built in the database with ST_AsGeoJSON and
+    json_build_object in the layout of GeoFeatureModelSerializer.
+
+    Parameters:
+        model: model of the queryset to annotate
+        geo_field: name of the geometry field
+        fields: names of the fields included as properties
+        id_field: name of the field written as the feature id, the id is left out if None
+    """
+    geometry = models.Func(models.F(geo_field), template='ST_AsGeoJSON(%(expressions)s)::json', output_field=models.TextField())
+    properties = json_object((f, json_property(model._meta.get_field(f))) for f in fields)
+    feature = [
+        ('type', models.Value('Feature')),
+        ('geometry', geometry),
+        ('properties', properties),
+    ]
+    if id_field:
+        feature.insert(0, ('id', json_property(model._meta.get_field(id_field))))
+    feature = json_object(feature)
+    return models.Func(feature, template='%(expressions)s::text', output_field=models.TextField())
+
+class StreamingGeoJSONMixin(object):
+    """
+    Viewset mixin that streams the list as a GeoJSON FeatureCollection when the stream query parameter is given.
+
+    The filtered queryset is iterated with a server-side cursor and every feature is written to a
+    StreamingHttpResponse as soon as it is fetched, so memory use stays flat regardless of the number of features.
+    With stream=true the features are serialized by the viewset's serializer, with stream=db PostGIS builds the
+    feature JSON and the view passes the text through. Streamed responses are not paginated: the limit and offset
+    parameters are honored when given, and all matching features are returned otherwise.
+    """
+    stream_param = 'stream'
+    stream_chunk_size = STREAM_CHUNK_SIZE
+
+    def get_stream_mode(self, request):
+        return request.query_params.get(self.stream_param, '').lower()
+
+    def slice_stream_queryset(self, request, queryset):
+        """
+        Applies the limit and offset query parameters of the paginator to the queryset, if they are given.
+        """
+        paginator = self.paginator
+        if paginator is None:
+            return queryset
+        offset = paginator.get_offset(request)
+        if paginator.limit_query_param in request.query_params:
+            return queryset[offset:offset + paginator.get_limit(request)]
+        return queryset[offset:]
+
+    def stream_features(self, queryset):
+        encoder = JSONEncoder()
+        serializer_class = self.get_serializer_class()
+        context = self.get_serializer_context()
+
+        yield '{"type":"FeatureCollection","features":['
+        for i, obj in enumerate(queryset.iterator(chunk_size=self.stream_chunk_size)):
+            feature = encoder.encode(serializer_class(obj, context=context).data)
+            yield feature if i == 0 else ',' + feature
+        yield ']}'
+
+    def stream_db_features(self, queryset):
+        # the serializer resolves its id field and adds the geometry to Meta.fields when it is created
+        serializer = self.get_serializer_class()()
+        meta = serializer.Meta
+        special = (meta.id_field, meta.geo_field, getattr(meta, 'bbox_geo_field', None))
+        properties = [f for f in serializer.fields if f not in special]
+        features = queryset.annotate(geojson_feature=geojson_feature(queryset.model, meta.geo_field, properties, meta.id_field))
+
+        yield '{"type":"FeatureCollection","features":['
+        for i, feature in enumerate(features.values_list('geojson_feature', flat=True).iterator(chunk_size=self.stream_chunk_size)):
+            yield feature if i == 0 else ',' + feature
+        yield ']}'
+
+    def stream(self, request, queryset, features):
+        queryset = self.slice_stream_queryset(request, queryset)
+        return StreamingHttpResponse(features(queryset), content_type='application/json')
+
+    def list(self, request, *args, **kwargs):
+        mode = self.get_stream_mode(request)
+        if mode == 'true':
+            return self.stream(request, self.filter_queryset(self.get_queryset()), self.stream_features)
+        if mode == 'db':
+            return self.stream(request, self.filter_queryset(self.get_queryset()), self.stream_db_features)
+        return super().list(request, *args, **kwargs)
@@ -0,0 +1,121 @@
+import math
+import os
+from django.conf import settings
+from django.contrib.gis.geos import Polygon
+from django.db import connections, models
+from django.http import Http404, HttpResponse
+from api.filecache import VersionedFileCache, filter_params, query_digest
+from api.models import DatasetVersion
+
+# half the width of the web mercator projection in meters
+MERCATOR_EXTENT = 20037508.342789244
+MVT_EXTENT = 4096
+MVT_BUFFER = 64
+# highest zoom level tiles are served for
+MAX_TILE_ZOOM = 22
+MVT_CONTENT_TYPE = 'application/vnd.mapbox-vector-tile'
+
+def tile_bounds(z, x, y):
+    """
+    Returns the (west, south, east, north) longitude/latitude bounds of the XYZ tile.
+    """
+    n = 2 ** z
+    def lon(tx):
+        return tx / n * 360.0 - 180.0
+    def lat(ty):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+    return lon(x), lat(y + 1), lon(x + 1), lat(y)
+
+def tile_mercator_bounds(z, x, y):
+    """
+    Returns the (xmin, ymin, xmax, ymax) web mercator bounds of the XYZ tile.
+    """
+    size = 2 * MERCATOR_EXTENT / 2 ** z
+    return -MERCATOR_EXTENT + x * size, MERCATOR_EXTENT - (y + 1) * size, -MERCATOR_EXTENT + (x + 1) * size, MERCATOR_EXTENT - y * size
+
+class MVTTileMixin(object):
+    """
+    Viewset mixin that serves Mapbox Vector Tiles of the filtered queryset, generated by PostGIS with ST_AsMVT.
+
+    Only rows whose geometry overlaps the tile are selected, using the spatial index of tile_geo_field. Generated
+    tiles are cached on disk under settings.TILE_CACHE_DIR per dataset version and filters applied, so a tile is
+    only generated once per data load, and are left out of the response cache of CachedResponseMixin. Tiles are
+    served for zoom levels up to MAX_TILE_ZOOM.
+    """
+    # read by CachedResponseMixin
+    uncached_actions = ('tile',)
+    tile_layer = None
+    # geometry field used to select the rows in a tile
+    tile_geo_field = None
+    # fields included as feature properties
+    tile_properties = ()
+
+    def get_tile_render_field(self, z):
+        """
+        Returns the geometry field drawn into tiles at zoom level z.
+        """
+        return self.tile_geo_field
+
+    def get_tile_cache(self):
+        model = self.queryset.model
+        versions, last_loaded = DatasetVersion.objects.load_info(model)
+        return VersionedFileCache(settings.TILE_CACHE_DIR, self.tile_layer, versions[model._meta.db_table])
+
+    def property_sql(self, field, qn):
+        column = 't.' + qn(field.column)
+        if isinstance(field, models.DecimalField):
+            return '{}::float8'.format(column)
+        if isinstance(field, (models.DateField, models.DateTimeField)):
+            return '{}::text'.format(column)
+        return column
+
+    def generate_tile(self, queryset, z, x, y):
+        model = queryset.model
+        connection = connections[queryset.db]
+        qn = connection.ops.quote_name
+
+        bbox = Polygon.from_bbox(tile_bounds(z, x, y))
+        bbox.srid = 4326
+        pks = queryset.filter(**{self.tile_geo_field + '__bboverlaps': bbox}).order_by().values('pk')
+        pk_sql, pk_params = pks.query.sql_with_params()
+
+        fields = [model._meta.get_field(f) for f in self.tile_properties]
+        sql = '''
+            SELECT ST_AsMVT(tile, %s, %s, 'geom') FROM (
+                SELECT ST_AsMVTGeom(ST_Transform(t.{geom}, 3857), ST_MakeEnvelope(%s, %s, %s, %s, 3857), %s, %s, true) AS geom, {properties}
+                FROM {table} AS t
+                WHERE t.{pk} IN ({pk_sql})
+            ) AS tile
+            WHERE geom IS NOT NULL
+        '''.format(
+            geom=qn(model._meta.get_field(self.get_tile_render_field(z)).column),
+            properties=', '.join('{} AS {}'.format(self.property_sql(f, qn), qn(f.name)) for f in fields),
+            table=qn(model._meta.db_table),
+            pk=qn(model._meta.pk.column),
+            pk_sql=pk_sql,
+        )
+        params = [self.tile_layer, MVT_EXTENT] + list(tile_mercator_bounds(z, x, y)) + [MVT_EXTENT, MVT_BUFFER] + list(pk_params)
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            tile = cursor.fetchone()[0]
+        return bytes(tile) if tile is not None else b''
+
+    def tile(self, request, z, x, y, format=None):
+        z, x, y = int(z), int(x), int(y)
+        if not (0 <= z <= MAX_TILE_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            raise Http404('Tile {}/{}/{} does not exist.'.format(z, x, y))
+
+        cache = self.get_tile_cache()
+        path = cache.path(query_digest(filter_params(self, request)), str(z), str(x), '{}.mvt'.format(y))
+        # returned as plain responses, since DRF drops the content type of the empty tiles outside the data
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                return HttpResponse(f.read(), content_type=MVT_CONTENT_TYPE)
+
+        tile = self.generate_tile(self.filter_queryset(self.get_queryset()), z, x, y)
+        def write_tile(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                f.write(tile)
+        cache.write(path, write_tile)
+        return HttpResponse(tile, content_type=MVT_CONTENT_TYPE)
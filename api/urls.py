@@ -1,5 +1,6 @@
 from django.urls import path, include
 from api import views
+from api.renderers import MVTRenderer
 from rest_framework_swagger.views import get_swagger_view
 from rest_framework.routers import DefaultRouter
 
@@ -16,6 +17,8 @@ router.register(r'taxlots', views.TaxlotDataViewSet)
 schema_view = get_swagger_view(title='Housing API')
 
 urlpatterns = [
+    path('api/permits/tiles/<int:z>/<int:x>/<int:y>.mvt', views.PermitDataViewSet.as_view({'get': 'tile'}, renderer_classes=[MVTRenderer]), name='permitdata-tile'),
+    path('api/taxlots/tiles/<int:z>/<int:x>/<int:y>.mvt', views.TaxlotDataViewSet.as_view({'get': 'tile'}, renderer_classes=[MVTRenderer]), name='taxlotdata-tile'),
     path('api/', include(router.urls)),
     path('', schema_view)
 ]
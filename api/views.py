@@ -1,105 +1,41 @@
-import re
 from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Count, Sum
 from django.core.serializers import serialize
+from django.contrib.gis.geos import Point
 from django.contrib.postgres.fields import ArrayField
-from django.db.models import Q
-from django.db.models.expressions import RawSQL
 from rest_framework.response import Response
 from rest_framework import viewsets
 from rest_framework.decorators import list_route
-from api.models import JCHSData, HudPitData, HudHicData, UrbanInstituteRentalCrisisData, Policy, Program, PermitData, TaxlotData
-from api.serializers import JCHSDataSerializer, HudPitDataSerializer, HudHicDataSerializer, UrbanInstituteRentalCrisisDataSerializer, PolicySerializer, ProgramSerializer, PermitDataSerializer, TaxlotDataSerializer
+from rest_framework.exceptions import ParseError
+from rest_framework_gis.filters import DistanceToPointFilter, GeometryFilter, InBBoxFilter
+from api.cache import CachedResponseMixin
+from api.exports import ExportMixin
+from api.facets import catalog_values, facet_values
+from api.models import PERMIT_SUMMARY_DIMENSIONS, TAXLOT_ROLLUP_GRID_SIZE, TAXLOT_ROLLUP_METRICS, PermitRollup, TaxlotRollup, JCHSData, HudPitData, HudHicData, UrbanInstituteRentalCrisisData, Policy, Program, PermitData, TaxlotData
+from api.pagination import KeysetLimitOffsetPagination
+from api.streaming import StreamingGeoJSONMixin
+from api.tiles import MVTTileMixin
+from api.ranking import order_mapping_rank
+from api.serializers import JCHSDataSerializer, HudPitDataSerializer, HudHicDataSerializer, UrbanInstituteRentalCrisisDataSerializer, PolicySerializer, ProgramSerializer, PermitDataSerializer, TaxlotDataSerializer, TaxlotDataLowZoomSerializer, TaxlotDataMidZoomSerializer
 from django_filters import rest_framework as filters
 
-def is_valid_table(tbl_name):
-    if re.match(r'^[a-z_]*$', tbl_name):
-        return True
-    return False
-
-# not sure if there is a better way to do this.
 class FilterRankedQueryMixin(object):
     @property
     def my_qs(self):
         """
-        Override to nest the ranking query inside of the filters, limiting, and ordering in order to allow for a ranking to be given out of all items, not just those included in the filtering.
+        Ranks are stored on each row and computed out of all items when the data is loaded, so filtering runs directly against the table without changing the ranking.
         """
-        try:
-            order_mapping = self.order_mapping
-            order_keys = self.order_keys
-        except AttributeError:
-            order_mapping = None
-            order_keys = None
-
-        try:
-            ignore_query = self.ignore_query
-        except AttributeError:
-            ignore_query = None
-
         filtered = super(FilterRankedQueryMixin, self).qs
-        ranked = self._meta.model.objects.with_rank()
-
-        if ignore_query is not None:
-            ignore = self._meta.model.objects.filter(datapoint='United States')
-            if order_mapping:
-                ignore = ignore.annotate(asc_rank=RawSQL('NULL', []), desc_rank=RawSQL('NULL', []), total=RawSQL('NULL', []))
-            else:
-                ignore = ignore.annotate(rank=RawSQL('NULL', []), total=RawSQL('NULL', []))
-            ignore_sql, ignore_params = ignore.query.sql_with_params()
-        else:
-            ignore_sql = None
-            ignore_params = None
-
-        filter_sql, filter_params = filtered.query.sql_with_params()
-        parts = filter_sql.split('WHERE')
-        if len(parts) > 1:
-            filter_part = parts[-1]
-            ranked_sql, ranked_params = ranked.query.sql_with_params()
-
-            cnt = filter_sql.count('%s')
-            params = ranked_params
-            if ignore_params is not None:
-                params = params + ignore_params
-            if cnt > 0:
-                params = params + filter_params[cnt*-1:]
-            tbl_name = self._meta.model.objects.model._meta.db_table
-            if not is_valid_table(tbl_name):
-                raise Exception("Invalid table name: {}".format(tbl_name))
-
-            if ignore_sql is not None:
-                ignore_sql = '''UNION ALL
-                                {}'''.format(ignore_sql)
-            else:
-                ignore_sql = ''
-            # wrap the ranked list of all items in the filter
-            qs = self._meta.model.objects.raw('''
-            SELECT * 
-            FROM (
-                {} 
-                {}
-            ) AS "{}" 
-            WHERE {}
-            '''.format(ranked_sql, ignore_sql, tbl_name, filter_part), params)
-        else:
-            qs = ranked
-
-        l = list(qs)
+        if not filtered.ordered:
+            filtered = filtered.order_by('pk')
 
+        order_mapping = getattr(self, 'order_mapping', None)
+        order_keys = getattr(self, 'order_keys', None)
         if order_mapping and order_keys:
-            for obj in l:
-                if isinstance(self.order_keys, str):
-                    order_key = getattr(obj, self.order_keys)
-                else:
-                    order_key = tuple(getattr(obj, field) for field in self.order_keys)
-                try:
-                    order = self.order_mapping[order_key]
-                except:
-                    #print('No mapping found for {}'.format(order_key))
-                    order = 'asc'
-                    
-                obj.rank = obj.desc_rank if order == 'desc' else obj.asc_rank
-
-        # need to convert to list in order to allow for pagination
-        self._qs = l
+            # choose between the ascending and descending rank inside the query
+            filtered = filtered.annotate(rank=order_mapping_rank(order_mapping, order_keys))
+
+        self._qs = filtered
         return self._qs
      
 class JCHSDataFilter(FilterRankedQueryMixin, filters.FilterSet):
@@ -113,7 +49,6 @@ class JCHSDataFilter(FilterRankedQueryMixin, filters.FilterSet):
             ('Change in Share of Units by Real Rent Level, 2005–2015, Real Gross Rents $2,000 or More', 'W-16'): 'desc',
     }
     order_keys = ('datatype', 'source')
-    ignore_query = Q(datapoint='United States')
 
     @property
     def qs(self):
@@ -126,28 +61,31 @@ class JCHSDataFilter(FilterRankedQueryMixin, filters.FilterSet):
         model = JCHSData
         fields = ['datatype', 'datapoint', 'valuetype', 'source', 'date']
 
-class JCHSDataViewSet(viewsets.ModelViewSet):
+class JCHSDataViewSet(CachedResponseMixin, ExportMixin, viewsets.ModelViewSet):
     queryset = JCHSData.objects.all()
     serializer_class = JCHSDataSerializer
     filter_class = JCHSDataFilter
     ordering_fields = '__all__'
+    facet_fields = ['datatype','datapoint','valuetype','source','date']
 
     @list_route()
     def meta(self, request):
-        queryset = self.filter_queryset(self.get_queryset())
-
         fields = request.data.get('fields') if request.data else request.query_params.get('fields')
         if fields is None:
-            fields = ['datatype','datapoint','valuetype','source','date']
+            fields = self.facet_fields
         elif isinstance(fields, str):
             fields = [fields]
 
-        results = {}
-        for f in fields:
-            f_name = f
-            if f == 'geography':
-                f = 'datapoint'
-            results[f_name] = queryset.values_list(f, flat=True).distinct().order_by(f)
+        names = {f: 'datapoint' if f == 'geography' else f for f in fields}
+        values = None
+        # unfiltered requests are answered from the catalog built by the loader
+        if not any(f in request.query_params for f in self.filter_class.base_filters):
+            values = catalog_values(JCHSData, set(names.values()))
+        if values is None:
+            queryset = self.filter_queryset(self.get_queryset())
+            values = facet_values(queryset, set(names.values()))
+
+        results = {f: values[names[f]] for f in fields}
 
         result = {
             'results': results
@@ -171,7 +109,7 @@ class HudPitDataFilter(FilterRankedQueryMixin, filters.FilterSet):
             return super().qs
         return self.my_qs
 
-class HudPitDataViewSet(viewsets.ModelViewSet):            
+class HudPitDataViewSet(CachedResponseMixin, ExportMixin, viewsets.ModelViewSet):            
     queryset = HudPitData.objects.all()
     serializer_class = HudPitDataSerializer
     filter_class = HudPitDataFilter
@@ -190,7 +128,7 @@ class HudHicDataFilter(filters.FilterSet):
             },
         }
 
-class HudHicDataViewSet(viewsets.ModelViewSet):            
+class HudHicDataViewSet(CachedResponseMixin, ExportMixin, viewsets.ModelViewSet):            
     queryset = HudHicData.objects.all()
     serializer_class = HudHicDataSerializer
     filter_class = HudHicDataFilter
@@ -216,7 +154,7 @@ class UrbanInstituteRentalCrisisDataFilter(FilterRankedQueryMixin, filters.Filte
             return super().qs
         return self.my_qs
 
-class UrbanInstituteRentalCrisisDataViewSet(viewsets.ModelViewSet):            
+class UrbanInstituteRentalCrisisDataViewSet(CachedResponseMixin, ExportMixin, viewsets.ModelViewSet):            
     queryset = UrbanInstituteRentalCrisisData.objects.all()
     serializer_class = UrbanInstituteRentalCrisisDataSerializer
     filter_class = UrbanInstituteRentalCrisisDataFilter
@@ -231,17 +169,11 @@ class UrbanInstituteRentalCrisisDataViewSet(viewsets.ModelViewSet):
         elif isinstance(fields, str):
             fields = [fields]
 
-        results = {}
-        for f in fields:
-            if f == 'geography':
-                qs = self.queryset.values_list('county_name', 'state_name').distinct().order_by('state_name', 'county_name')
-                unique = {}
-                for c, s in qs:
-                    key = '{}, {}'.format(c, s)
-                    unique[key.lower()] = key
-                results[f] = unique.values()
-                continue
-            results[f] = self.queryset.values_list(f, flat=True).annotate(lower=Lower(f)).distinct().order_by(f)
+        results = catalog_values(UrbanInstituteRentalCrisisData, fields)
+        if results is None:
+            results = facet_values(self.queryset, [f for f in fields if f != 'geography'])
+            if 'geography' in fields:
+                results['geography'] = UrbanInstituteRentalCrisisData.objects.geographies()
 
         result = {
             'results': results
@@ -267,18 +199,38 @@ class ProgramFilter(filters.FilterSet):
         model = Program
         fields = '__all__'
 
-class PolicyViewSet(viewsets.ModelViewSet):
+class PolicyViewSet(CachedResponseMixin, ExportMixin, viewsets.ModelViewSet):
     queryset = Policy.objects.all()
     serializer_class = PolicySerializer
     filter_class = PolicyFilter
     order_fields = '__all__'
 
-class ProgramViewSet(viewsets.ModelViewSet):
+class ProgramViewSet(CachedResponseMixin, ExportMixin, viewsets.ModelViewSet):
     queryset = Program.objects.all()
     serializer_class = ProgramSerializer
     filter_class = ProgramFilter
     order_fields = '__all__'
 
+class WithinDistanceFilter(DistanceToPointFilter):
+    """
+    Filters the view's distance_filter_field to within a distance of a point, given as within_distance=lon,lat,meters. Uses ST_DWithin so that the spatial index is used.
+    """
+    within_distance_param = 'within_distance'
+
+    def filter_queryset(self, request, queryset, view):
+        filter_field = getattr(view, 'distance_filter_field', None)
+        param = request.query_params.get(self.within_distance_param)
+        if not filter_field or not param:
+            return queryset
+
+        try:
+            lon, lat, meters = (float(n) for n in param.split(','))
+        except ValueError:
+            raise ParseError('Invalid within_distance string supplied for parameter {0}, expected lon,lat,meters'.format(self.within_distance_param))
+
+        point = Point(lon, lat, srid=4326)
+        return queryset.filter(**{'{}__dwithin'.format(filter_field): (point, self.dist_to_deg(meters, lat))})
+
 class PermitDataFilter(filters.FilterSet):
     new_class = CharInFilter(name='new_class', lookup_expr='in')
     new_type = CharInFilter(name='new_type', lookup_expr='in')
@@ -289,27 +241,144 @@ class PermitDataFilter(filters.FilterSet):
     work_description = filters.CharFilter(lookup_expr='iexact')
     year = filters.NumberFilter()
     year_range = filters.RangeFilter(name='year')
+    intersects = GeometryFilter(name='point', lookup_expr='intersects')
 
     class Meta:
         model = PermitData
-        fields = ('new_class','new_type','status','is_adu','property_address','neighborhood','work_description','year','year_range')
+        fields = ('new_class','new_type','status','is_adu','property_address','neighborhood','work_description','year','year_range','intersects')
 
-class PermitDataViewSet(viewsets.ModelViewSet):
+class PermitDataViewSet(CachedResponseMixin, ExportMixin, MVTTileMixin, StreamingGeoJSONMixin, viewsets.ModelViewSet):
     queryset = PermitData.objects.all()
     serializer_class = PermitDataSerializer
+    pagination_class = KeysetLimitOffsetPagination
+    keyset_ordering = ('issue_date', 'id')
+    cache_models = [PermitData, PermitRollup]
     filter_class = PermitDataFilter
+    filter_backends = (filters.DjangoFilterBackend, InBBoxFilter, WithinDistanceFilter)
+    bbox_filter_field = 'point'
+    bbox_filter_include_overlapping = True
+    distance_filter_field = 'point'
+    tile_layer = 'permits'
+    tile_geo_field = 'point'
+    tile_properties = ('issue_date','year','status','new_class','new_type','neighborhood','is_adu','new_units','valuation')
+    # summary metrics as (aggregate over permits, aggregate over the rollup)
+    summary_metrics = {
+        'count': (Count('pk'), Sum('permit_count')),
+        'total_new_units': (Sum('new_units'), Sum('new_units')),
+        'total_valuation': (Sum('valuation'), Sum('valuation')),
+    }
+    # query parameters of the filters that can be answered from the rollup, which only keeps PERMIT_SUMMARY_DIMENSIONS
+    rollup_filters = ('year','year_range_0','year_range_1','neighborhood','new_class','is_adu')
+
+    @list_route()
+    def summary(self, request):
+        group_by = [d for d in request.query_params.get('group_by', '').split(',') if d]
+        metrics = [m for m in request.query_params.get('metrics', 'count').split(',') if m]
+        invalid = [d for d in group_by if d not in PERMIT_SUMMARY_DIMENSIONS] + [m for m in metrics if m not in self.summary_metrics]
+        if invalid:
+            raise ParseError('Invalid group_by or metrics: {}'.format(', '.join(invalid)))
+
+        params = set(request.query_params) - {'group_by', 'metrics', 'format'}
+        if params.issubset(self.rollup_filters):
+            queryset = self.filter_class(request.query_params, queryset=PermitRollup.objects.all(), request=request).qs
+            aggregates = {m: self.summary_metrics[m][1] for m in metrics}
+        else:
+            queryset = self.filter_queryset(self.get_queryset())
+            aggregates = {m: self.summary_metrics[m][0] for m in metrics}
+
+        if group_by:
+            results = list(queryset.order_by(*group_by).values(*group_by).annotate(**aggregates))
+        else:
+            results = [queryset.aggregate(**aggregates)]
+
+        result = {
+            'results': results
+        }
+
+        return Response(result)
 
 class TaxlotDataFilter(filters.FilterSet):
     year = filters.NumberFilter()
     year_range = filters.RangeFilter(name='year')
     total_value = filters.RangeFilter()
     percent_change = filters.RangeFilter()
+    intersects = GeometryFilter(name='mpoly', lookup_expr='intersects')
 
     class Meta:
         model = TaxlotData
-        fields = ('year','year_range','total_value','percent_change')
+        fields = ('year','year_range','total_value','percent_change','intersects')
 
-class TaxlotDataViewSet(viewsets.ModelViewSet):
+class TaxlotDataViewSet(CachedResponseMixin, ExportMixin, MVTTileMixin, StreamingGeoJSONMixin, viewsets.ModelViewSet):
     queryset = TaxlotData.objects.all()
     serializer_class = TaxlotDataSerializer
+    pagination_class = KeysetLimitOffsetPagination
+    keyset_ordering = ('year', 'id')
+    cache_models = [TaxlotData, TaxlotRollup]
     filter_class = TaxlotDataFilter
+    filter_backends = (filters.DjangoFilterBackend, InBBoxFilter, WithinDistanceFilter)
+    bbox_filter_field = 'mpoly'
+    bbox_filter_include_overlapping = True
+    distance_filter_field = 'mpoly'
+    tile_layer = 'taxlots'
+    tile_geo_field = 'mpoly'
+    tile_properties = ('year','percent_change')
+    export_exclude = ('mpoly_low', 'mpoly_mid')
+    zoom_serializer_classes = {
+        'mpoly': TaxlotDataSerializer,
+        'mpoly_low': TaxlotDataLowZoomSerializer,
+        'mpoly_mid': TaxlotDataMidZoomSerializer,
+    }
+
+    def get_geo_field(self):
+        """
+        Returns the geometry field for the map zoom level given by the zoom query parameter, full resolution if there is none.
+        """
+        try:
+            zoom = int(self.request.query_params['zoom'])
+        except (KeyError, ValueError):
+            return 'mpoly'
+        return TaxlotData.objects.zoom_field(zoom)
+
+    def get_tile_render_field(self, z):
+        return TaxlotData.objects.zoom_field(z)
+
+    def get_queryset(self):
+        geo_field = self.get_geo_field()
+        # don't pull geometries from the database that won't be serialized
+        return super().get_queryset().defer(*[f for f in self.zoom_serializer_classes if f != geo_field])
+
+    def get_serializer_class(self):
+        return self.zoom_serializer_classes[self.get_geo_field()]
+
+    @list_route()
+    def rollups(self, request):
+        geography = request.query_params.get('geography', 'city')
+        metrics = [m for m in request.query_params.get('metrics', '').split(',') if m]
+        invalid = [m for m in metrics if m not in TAXLOT_ROLLUP_METRICS]
+        if geography not in ('city', 'grid') or invalid:
+            raise ParseError('Invalid geography or metrics: {}'.format(', '.join([geography] + invalid)))
+
+        queryset = TaxlotRollup.objects.filter(geography=geography)
+        if metrics:
+            queryset = queryset.filter(metric__in=metrics)
+        if 'year' in request.query_params:
+            try:
+                queryset = queryset.filter(year=int(request.query_params['year']))
+            except ValueError:
+                raise ParseError('Invalid year: {}'.format(request.query_params['year']))
+
+        fields = ['year', 'metric', 'lot_count', 'p25', 'median', 'p75', 'mean']
+        if geography == 'grid':
+            fields += ['cell_x', 'cell_y']
+        results = list(queryset.order_by('metric', 'year', 'cell_x', 'cell_y').values(*fields))
+        if geography == 'grid':
+            # replace the cell indices with the (west, south, east, north) bounds of the cell
+            for row in results:
+                x, y = row.pop('cell_x'), row.pop('cell_y')
+                row['cell'] = [x * TAXLOT_ROLLUP_GRID_SIZE, y * TAXLOT_ROLLUP_GRID_SIZE, (x + 1) * TAXLOT_ROLLUP_GRID_SIZE, (y + 1) * TAXLOT_ROLLUP_GRID_SIZE]
+
+        result = {
+            'results': results
+        }
+
+        return Response(result)
@@ -95,6 +95,38 @@ DATABASES = {
     }
 }
 
+# Caches
+# https://docs.djangoproject.com/en/2.0/topics/cache/
+# API responses are cached until the datasets they're built from are reloaded (see api/cache.py). Any Django cache
+# backend can be used, e.g. API_CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache with a directory
+# as API_CACHE_LOCATION to share the cache between gunicorn workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': {
+        'BACKEND': os.environ.get('API_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('API_CACHE_LOCATION', 'api-responses'),
+        'TIMEOUT': int(os.environ.get('API_CACHE_TIMEOUT', 24 * 60 * 60)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('API_CACHE_MAX_ENTRIES', 1000)),
+        },
+    },
+}
+
+API_CACHE_ALIAS = 'api'
+# Responses larger than this many bytes are not cached
+API_CACHE_MAX_RESPONSE_SIZE = int(os.environ.get('API_CACHE_MAX_RESPONSE_SIZE', 1024 * 1024))
+
+# Directory Mapbox Vector Tiles from /api/permits/tiles/ and /api/taxlots/tiles/ are cached in
+TILE_CACHE_DIR = os.environ.get('TILE_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'tiles'))
+
+# Directory files from the export endpoints are cached in
+EXPORT_CACHE_DIR = os.environ.get('EXPORT_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'exports'))
+# Number of export files kept per dataset, the least recently generated are deleted first
+EXPORT_CACHE_MAX_FILES = int(os.environ.get('EXPORT_CACHE_MAX_FILES', 50))
+
 # 2018-06-20: commenting out this block in pursuit of https://github.com/hackoregon/civic-devops/issues/177
 # if DEBUG == False:
 
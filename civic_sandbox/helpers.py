@@ -1,12 +1,71 @@
 import json 
+from datetime import datetime, timedelta
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from django.conf import settings
-from django.contrib.gis.geos import GEOSGeometry, MultiPoint, MultiPolygon, MultiLineString
+from django.core.cache import caches
+from django.contrib.gis.db.models import Collect, GeometryField
+from django.db.models import Func
+from django.utils import timezone
+from api.models import DatasetVersion
 
+# distinguishes a cache miss from a cached empty boundary
+MISSING = object()
 
-def sandbox_view_factory(model_class, serializer_class, multi_geom_class, geom_field, attributes, dates):
+def limit_boundary(dataset, geom_field):
+    """
+    Returns the convex hull of every geometry in the dataset as GeoJSON, computed in the database with a single
+    ST_ConvexHull(ST_Collect(...)) aggregate, or None if the dataset has no geometries.
+
+    Parameters:
+        dataset: queryset to compute the boundary of
+        geom_field: name of the geometry field
+    """
+    hull = dataset.aggregate(boundary=Func(Collect(geom_field), function='ST_ConvexHull', output_field=GeometryField()))['boundary']
+    return hull.json if hull is not None else None
+
+def cached_limit_boundary(dataset, geom_field, date_filter):
+    """
+    Returns limit_boundary for the dataset, cached per date_filter and load version of the dataset's table so that
+    the aggregate only runs once per reload.
+    """
+    table = dataset.model._meta.db_table
+    versions, _ = DatasetVersion.objects.load_info(dataset.model)
+    key = 'sandbox.boundary.{}.{}.{}.{}'.format(table, geom_field, versions[table], date_filter)
+    cache = caches[settings.API_CACHE_ALIAS]
+    boundary = cache.get(key, MISSING)
+    if boundary is MISSING:
+        boundary = limit_boundary(dataset, geom_field)
+        cache.set(key, boundary)
+    return boundary
+
+# date_filter format of each date_granularity
+DATE_FILTER_FORMATS = {
+    'year': '%Y',
+    'month': '%Y%m',
+    'day': '%Y%m%d',
+}
+
+def date_range(date_filter, granularity):
+    """
+    Returns the half-open (start, end) range of UTC datetimes covered by a date_filter, so that it can be filtered
+    with an index range scan. Raises ValueError if the date_filter does not match the granularity.
+
+    Parameters:
+        date_filter: date string formatted as YYYY, YYYYMM or YYYYMMDD for year, month and day granularity
+        granularity: one of DATE_FILTER_FORMATS
+    """
+    start = datetime.strptime(date_filter, DATE_FILTER_FORMATS[granularity])
+    if granularity == 'year':
+        end = start.replace(year=start.year + 1)
+    elif granularity == 'month':
+        end = start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    else:
+        end = start + timedelta(days=1)
+    return timezone.make_aware(start, timezone.utc), timezone.make_aware(end, timezone.utc)
+
+def sandbox_view_factory(model_class, serializer_class, geom_field, attributes, dates):
     @api_view(['GET'])
     def sandbox_function(request, date_filter=dates['default_date_filter'], format=None): 
 
@@ -16,28 +75,19 @@ def sandbox_view_factory(model_class, serializer_class, multi_geom_class, geom_f
                 dataset= model_class.objects.all()
             else:
                 variable_column = dates['date_attribute']
-                filter = variable_column + '__contains'
-                dataset= model_class.objects.filter(**{ filter: date_filter })
+                try:
+                    start, end = date_range(date_filter, dates['date_granularity'])
+                except ValueError:
+                    return Response({'detail': 'Invalid {} date filter {}'.format(dates['date_granularity'], date_filter)}, status=status.HTTP_400_BAD_REQUEST)
+                dataset= model_class.objects.filter(**{ variable_column + '__gte': start, variable_column + '__lt': end })
                 if settings.DEBUG: print('---------------------------------------')
-                if settings.DEBUG: print(filter)
-                if settings.DEBUG: print(date_filter)
+                if settings.DEBUG: print(variable_column, start, end)
 
 
             if settings.DEBUG: print('made queryset')
         
         # calculate limit boundary meta #
-            coords = []
-            for each in dataset: 
-                geom = getattr(each, geom_field)
-                if geom is not None:
-                ## converts MultiPolygons to Polygons ##
-                  if isinstance(geom, MultiPolygon):
-                      coords.append(geom.convex_hull)
-                  else: 
-                      coords.append(geom)
-              
-            multi = multi_geom_class(coords)
-            limit_boundary = multi.convex_hull.json
+            boundary = cached_limit_boundary(dataset, geom_field, date_filter if dates['date_attribute'] else None)
 
             if settings.DEBUG: print('boundary calculation complete')
             
@@ -48,7 +98,7 @@ def sandbox_view_factory(model_class, serializer_class, multi_geom_class, geom_f
 
         response= { 
             'slide_meta': {
-                'boundary': [json.loads(limit_boundary)],
+                'boundary': [json.loads(boundary)] if boundary is not None else [],
                 'dates': dates,
                 'attributes': attributes
                 },
@@ -1,3 +1,21 @@
+from datetime import datetime
 from django.test import TestCase
+from django.utils import timezone
+from civic_sandbox.helpers import date_range
 
-# Create your tests here.
+
+def utc(*args):
+    return timezone.make_aware(datetime(*args), timezone.utc)
+
+class DateRangeTest(TestCase):
+    """ Tests for the date_filter to range translation of the sandbox slides """
+
+    def test_granularities(self):
+        self.assertEqual(date_range('2017', 'year'), (utc(2017, 1, 1), utc(2018, 1, 1)))
+        self.assertEqual(date_range('201712', 'month'), (utc(2017, 12, 1), utc(2018, 1, 1)))
+        self.assertEqual(date_range('201702', 'month'), (utc(2017, 2, 1), utc(2017, 3, 1)))
+        self.assertEqual(date_range('20171231', 'day'), (utc(2017, 12, 31), utc(2018, 1, 1)))
+
+    def test_invalid_filter(self):
+        with self.assertRaises(ValueError):
+            date_range('201713', 'month')
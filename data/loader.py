@@ -1,3 +1,4 @@
+import os
 from data.loaders.jchs_data_2017 import load_data as load_jchs_data
 from data.loaders.hud_homelessness import load_data as load_hud_data
 from data.loaders.urbaninstitute_rentalcrisis import load_data as load_urbaninstitute_data
@@ -5,9 +6,12 @@ from data.loaders.policy_inventory import load_data as load_policy_data
 from data.loaders.permit_data import run as load_permit_data
 from data.loaders.taxlot_data import run as load_taxlot_data
 
-load_jchs_data()
-load_hud_data()
-load_urbaninstitute_data()
-load_policy_data()
-load_permit_data()
-load_taxlot_data()
+# only sources that changed since the last load are loaded, unless FULL_RELOAD is set
+full = bool(os.environ.get('FULL_RELOAD'))
+
+load_jchs_data(full=full)
+load_hud_data(full=full)
+load_urbaninstitute_data(full=full)
+load_policy_data(full=full)
+load_permit_data(full=full)
+load_taxlot_data(full=full)
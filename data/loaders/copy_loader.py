@@ -0,0 +1,195 @@
+from autoslug import AutoSlugField
+from autoslug.utils import crop_slug
+from django.contrib.gis.db.models import GeometryField
+from django.contrib.gis.geos import GEOSGeometry
+from django.contrib.postgres.fields import ArrayField
+from django.db import connections, models, router, transaction
+from api.models import DatasetVersion
+
+# size of the chunks sent to COPY
+COPY_BUFFER_SIZE = 64 * 1024
+
+def copy_escape(value):
+    """
+    Escapes a value for the PostgreSQL COPY text format.
+    """
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def array_literal(values):
+    """
+    Returns the PostgreSQL array literal of a list of text values.
+    """
+    return '{' + ','.join('"{}"'.format(str(v).replace('\\', '\\\\').replace('"', '\\"')) for v in values) + '}'
+
+class Slugger(object):
+    """
+    Computes the value of an AutoSlugField the way the field does on save, caching the slug of every distinct value
+    since the loaders repeat the same few values for most rows.
+    """
+    def __init__(self, field):
+        self.field = field
+        self.source = field.model._meta.get_field(field.populate_from)
+        self.slugs = {}
+
+    def __call__(self, row):
+        value = row.get(self.source.name)
+        if value not in self.slugs:
+            slug = self.field.slugify(value) if value else None
+            if slug:
+                slug = crop_slug(self.field, slug)
+            elif not self.field.blank:
+                slug = self.field.model._meta.model_name
+            elif not self.field.null:
+                slug = ''
+            self.slugs[value] = slug
+        return self.slugs[value]
+
+class RowReader(object):
+    """
+    File-like object that reads rows of field values in the COPY text format, for cursor.copy_expert.
+    """
+    def __init__(self, fields, rows, connection):
+        self.connection = connection
+        self.fields = fields
+        self.rows = iter(rows)
+        self.sluggers = {f.name: Slugger(f) for f in fields if isinstance(f, AutoSlugField)}
+        self.buffer = ''
+        self.count = 0
+
+    def column_value(self, field, row):
+        if field.name in self.sluggers:
+            value = self.sluggers[field.name](row)
+        elif field.name in row:
+            value = row[field.name]
+        elif field.attname in row:
+            value = row[field.attname]
+        else:
+            value = field.get_default()
+
+        if isinstance(value, models.Model):
+            value = value.pk
+        if value is None:
+            return '\\N'
+        if isinstance(field, ArrayField):
+            return copy_escape(array_literal(value))
+        if isinstance(field, GeometryField):
+            # hex EWKB is read by the geometry type's input function, unlike the adapter get_db_prep_save returns
+            geom = value if isinstance(value, GEOSGeometry) else GEOSGeometry(value)
+            if geom.srid is None:
+                geom.srid = field.srid
+            return geom.hexewkb.decode('ascii')
+        value = field.get_db_prep_save(value, self.connection)
+        return '\\N' if value is None else copy_escape(value)
+
+    def line(self, row):
+        return '\t'.join(self.column_value(f, row) for f in self.fields) + '\n'
+
+    def read(self, size=-1):
+        while self.rows is not None and (size < 0 or len(self.buffer) < size):
+            row = next(self.rows, None)
+            if row is None:
+                self.rows = None
+            else:
+                self.buffer += self.line(row)
+                self.count += 1
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+def layer_rows(layer_mapping, **values):
+    """
+    Yields the field values of each feature of a LayerMapping's layer as rows for copy_rows, converted and validated
+    the way LayerMapping.save does, along with values.
+    """
+    for feature in layer_mapping.layer:
+        row = layer_mapping.feature_kwargs(feature)
+        row.update(values)
+        yield row
+
+def diff_rows(cursor, table, pk, columns, replace):
+    """
+    Replaces the rows of the replace queryset with the rows in loader_staging by deleting only the current rows
+    that are not staged and inserting only the staged rows that are not current. Rows are matched by the md5 of
+    their columns and numbered within each hash, so that duplicate rows are kept as many times as they are staged.
+
+    Returns: Number of rows deleted and inserted.
+    """
+    def row_hash(alias):
+        return 'md5(ROW({})::text)'.format(', '.join('{}.{}'.format(alias, c) for c in columns))
+
+    replace_sql, replace_params = replace.order_by().values('pk').query.sql_with_params()
+    cursor.execute('''
+        CREATE TEMPORARY TABLE loader_current ON COMMIT DROP AS
+        SELECT t.{pk} AS pk, {hash} AS row_hash, row_number() OVER (PARTITION BY {hash}) AS n
+        FROM {table} AS t WHERE t.{pk} IN ({replace})
+    '''.format(pk=pk, hash=row_hash('t'), table=table, replace=replace_sql), replace_params)
+    cursor.execute('''
+        CREATE TEMPORARY TABLE loader_new ON COMMIT DROP AS
+        SELECT s.*, {hash} AS row_hash, row_number() OVER (PARTITION BY {hash}) AS n FROM loader_staging AS s
+    '''.format(hash=row_hash('s')))
+
+    cursor.execute('''
+        DELETE FROM {table} WHERE {pk} IN (
+            SELECT c.pk FROM loader_current AS c LEFT JOIN loader_new AS s ON s.row_hash = c.row_hash AND s.n = c.n
+            WHERE s.row_hash IS NULL
+        )
+    '''.format(table=table, pk=pk))
+    changed = cursor.rowcount
+    cursor.execute('''
+        INSERT INTO {table} ({columns})
+        SELECT {staged} FROM loader_new AS s LEFT JOIN loader_current AS c ON c.row_hash = s.row_hash AND c.n = s.n
+        WHERE c.row_hash IS NULL
+    '''.format(table=table, columns=', '.join(columns), staged=', '.join('s.' + c for c in columns)))
+    changed += cursor.rowcount
+    cursor.execute('DROP TABLE loader_current, loader_new')
+    return changed
+
+def copy_rows(model, rows, replace=None, diff=False):
+    """
+    Loads rows into the model's table with COPY FROM STDIN instead of creating model objects. Rows are streamed into a
+    temporary staging table, with AutoSlugField values computed in bulk, then in a single transaction the rows of the
+    replace queryset are deleted and the staged rows are inserted, so readers see either the old or the new data.
+
+    With diff, only the rows that changed are deleted and inserted, compared on every column except the rank_fields
+    and derived_fields of the model's manager, which are computed from the loaded rows and left empty on the
+    inserted ones. Unchanged rows keep their ids and computed fields, and the dataset version is only bumped if
+    anything changed.
+
+    Returns: Number of rows loaded.
+
+    Parameters:
+        model: Django model to load
+        rows: iterable of dicts of field name or attname to value, fields that are missing get their default. Rows
+            are read while the COPY is running, so a generator of rows must not query the database
+        replace: queryset of the rows the new rows replace, if any
+        diff: only write the rows that differ from those of replace
+    """
+    db = router.db_for_write(model)
+    connection = connections[db]
+    qn = connection.ops.quote_name
+    fields = [f for f in model._meta.concrete_fields if not isinstance(f, models.AutoField)]
+    columns = ', '.join(qn(f.column) for f in fields)
+    table = qn(model._meta.db_table)
+
+    changed = True
+    with transaction.atomic(using=db), connection.cursor() as cursor:
+        cursor.execute('CREATE TEMPORARY TABLE loader_staging ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA'.format(columns, table))
+        reader = RowReader(fields, rows, connection)
+        cursor.copy_expert('COPY loader_staging ({}) FROM STDIN'.format(columns), reader, size=COPY_BUFFER_SIZE)
+
+        if diff and replace is not None:
+            manager = model._default_manager
+            derived = set(getattr(manager, 'rank_fields', ())) | set(getattr(manager, 'derived_fields', ()))
+            compared = [qn(f.column) for f in fields if f.name not in derived]
+            changed = diff_rows(cursor, table, qn(model._meta.pk.column), compared, replace) > 0
+        else:
+            if replace is not None:
+                replace.delete()
+            cursor.execute('INSERT INTO {table} ({columns}) SELECT {columns} FROM loader_staging'.format(table=table, columns=columns))
+        # dropped explicitly since ON COMMIT only applies to the outermost transaction
+        cursor.execute('DROP TABLE loader_staging')
+
+    if changed:
+        DatasetVersion.objects.bump(model)
+    return reader.count
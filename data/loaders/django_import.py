@@ -1,3 +1,5 @@
+from data.loaders.copy_loader import copy_rows
+
 class DjangoImport(object):
     django_model = None
 
@@ -17,15 +19,6 @@ class DjangoImport(object):
         """
         raise NotImplementedError("process_frame must be implemented by child class.")
         
-    def generate_objects(self):
-        """
-        Generator function to create Django objects to save to the database. Takes the json generated from 
-        self.generate_json and creates objects out of it.
-        """
-        for body in self.generate_json():
-            obj = self.django_model(**body)
-            yield obj
-
     def get_queryset(self):
         """
         Returns all objects that come from this particular import e.g. for sheet A-1 import it will return all objects with source A-1
@@ -37,7 +30,7 @@ class DjangoImport(object):
 
     def save(self, delete_existing=True, query=None):
         """
-        Adds the dataframe to the database via the Django ORM using self.generate_objects to generate Django objects.
+        Adds the dataframe to the database with copy_rows using the json generated by self.generate_json.
 
         Returns: Number of records added to database.
         
@@ -50,16 +43,17 @@ class DjangoImport(object):
         if self.data is None:
             raise Exception("self.df has not been set, nothing to add to database.")
             
+        qs = None
         if delete_existing:
             if query is None:
                 qs = self.get_queryset()
             else:
-                qs = django_model.objects.filter(query)
-            # delete existing items in index
-            qs.delete()
+                qs = self.django_model.objects.filter(query)
 
-        results = self.django_model.objects.bulk_create(self.generate_objects(), batch_size=10000)
-        return len(results)
+        # generate_json may query the database, which can't be done while the COPY is running
+        rows = list(self.generate_json())
+        # existing items are deleted in the same transaction the new ones are added in
+        return copy_rows(self.django_model, rows, replace=qs)
         
     def is_valid_decimal(self, val):
         """
@@ -2,9 +2,14 @@ import re
 import os
 from decimal import Decimal
 import pandas as pd
-from api.models import HudPitData, HudHicData
+from api.models import HudPitData, HudHicData, LoadManifest
+from data.loaders.copy_loader import copy_rows
+from data.loaders.manifest import file_hash, load_scope
 import boto3
 
+# bumped when the way the source is parsed changes, so that every partition is reloaded
+LOADER_VERSION = 1
+
 BUCKET_NAME = 'hacko-data-archive'
 KEY = '2018-housing-affordability/data/hud_homelessness/'
 s3 = boto3.resource('s3')
@@ -32,15 +37,6 @@ class DjangoImport(object):
         """
         raise NotImplementedError("process_frame must be implemented by child class.")
         
-    def generate_objects(self):
-        """
-        Generator function to create Django objects to save to the database. Takes the json generated from 
-        self.generate_json and creates objects out of it.
-        """
-        for body in self.generate_json():
-            obj = self.django_model(**body)
-            yield obj
-
     def get_queryset(self):
         """
         Returns all objects that come from this particular import
@@ -52,7 +48,7 @@ class DjangoImport(object):
 
     def save(self, delete_existing=True, query=None):
         """
-        Adds the dataframe to the database via the Django ORM using self.generate_objects to generate Django objects.
+        Adds the dataframe to the database with copy_rows using the json generated by self.generate_json.
         
         Parameters:
             delete_existing: option to delete the existing items for this import
@@ -63,16 +59,15 @@ class DjangoImport(object):
         if self.df is None:
             raise Exception("self.df has not been set, nothing to add to database.")
             
+        qs = None
         if delete_existing:
             if query is None:
                 qs = self.get_queryset()
             else:
-                qs = django_model.objects.filter(query)
-            # delete existing items in index
-            qs.delete()
+                qs = self.django_model.objects.filter(query)
 
-        results = self.django_model.objects.bulk_create(self.generate_objects(), batch_size=10000)
-        return len(results)
+        # only the rows that changed are deleted and added, in the same transaction
+        return copy_rows(self.django_model, self.generate_json(), replace=qs, diff=True)
         
     def is_valid_value(self, val):
         try: 
@@ -156,11 +151,6 @@ class Hic(DjangoImport):
 
         self.df = dic
 
-    def generate_objects(self):
-        for body in self.generate_json():
-            obj = HudHicData(**body)
-            yield obj
-
     def generate_json(self):
         for key, df in self.df.items():
             try:
@@ -230,7 +220,7 @@ class Hic(DjangoImport):
 
                     yield body
 
-def load_data():
+def load_data(full=False):
 #    URLS = [
 #        'https://www.hudexchange.info/resources/documents/2007-2017-HIC-Counts-by-CoC.XLSX',
 #        'https://www.hudexchange.info/resources/documents/2007-2017-HIC-Counts-by-State.xlsx',
@@ -252,7 +242,8 @@ def load_data():
         Pit(files[3], geography='state'),
     ]
     
-    ct = 0
+    # each file is a partition of its model by geography
+    hashes = {HudPitData: {}, HudHicData: {}}
     for imp in imports:
         f = imp.file_loc
         file_path = '/data/hud_homelessness/{}'.format(f)
@@ -260,10 +251,25 @@ def load_data():
             key = KEY + f
             s3.Bucket(BUCKET_NAME).download_file(key, file_path)
         imp.file_loc = file_path
-        imp.process_frame()
-        distinct = []
-        result = imp.save()
-        ct += result
+        hashes[imp.django_model][imp.geography] = file_hash(file_path)
+
+    if not full:
+        hashes = {model: LoadManifest.objects.changed(model, h, version=LOADER_VERSION) for model, h in hashes.items()}
+        imports = [imp for imp in imports if imp.geography in hashes[imp.django_model]]
+        if not imports:
+            print('HUD files are unchanged.')
+            return
+
+    ct = 0
+    with load_scope(HudPitData, HudHicData, full=full):
+        for imp in imports:
+            imp.process_frame()
+            result = imp.save()
+            ct += result
+
+        print(f'Loaded {ct} rows.')
+        print(f'Ranked {HudPitData.objects.refresh_rank()} rows.')
 
-    print(f'Loaded {ct} rows.')
+    for model, h in hashes.items():
+        LoadManifest.objects.record(model, h, version=LOADER_VERSION, replace=full)
 
@@ -5,12 +5,21 @@ import requests
 import pandas as pd
 import numpy as np
 import pytz
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
+from timeit import default_timer as timer
 from pytz import timezone
 from six.moves.urllib.request import urlopen
-from api.models import JCHSData
+from django.db import connections
+from api.facets import build_catalog
+from api.models import JCHSData, DatasetVersion, LoadManifest
+from data.loaders.copy_loader import copy_rows
+from data.loaders.manifest import file_hash, load_scope, rows_hash
 import boto3
 
+# bumped when the way the source is parsed changes, so that every partition is reloaded
+LOADER_VERSION = 1
+
 BUCKET_NAME = 'hacko-data-archive'
 KEY = '2018-housing-affordability/data/all_son_2017_tables_current_6_12_17.xlsx'
 s3 = boto3.resource('s3')
@@ -42,13 +51,25 @@ headers = {
     'W-18': [3],
 }
 
+# fields listed by the /api/harvardjchs/meta/ endpoint
+JCHS_FACET_FIELDS = ['datatype', 'datapoint', 'valuetype', 'source', 'date']
+
 # manual input of text that isn't included in the pandas-parsed table
 manual_sections = {
     'W-1': 'High Poverty',
 }
 
+def year_date(year, month=1):
+    """
+    Returns the first of the month of a year as the Pacific time datetime the JCHS dates are stored as.
+    """
+    return datetime(int(year), month, 1, tzinfo=pytz.utc).astimezone(pacific)
+
 # Define import classes
 class DjangoImport(object):
+    # multiplier applied to every value of the sheet
+    value_scale = 1
+
     def __init__(self, source, data_file):
         """
         Base class to import JCHS data from an Excel sheet into database via Django ORM.
@@ -68,23 +89,49 @@ class DjangoImport(object):
         """
         raise NotImplemented("process_frame must be implemented by child class.")
         
-    def generate_objects(self):
-        """
-        Generator function to create Django objects to save to the database. Takes the json generated from 
-        self.generate_json and creates objects out of it.
-        """
-        for body in self.generate_json():
-            obj = JCHSData(**body)
-            yield obj
-
     def get_queryset(self):
         """
         Returns all objects that come from this particular import e.g. for sheet A-1 import it will return all objects with source A-1
         """
         return JCHSData.objects.filter(source=self.source)
                 
+    def row_meta(self, ix):
+        """
+        Returns the fields of the objects in a row of self.df that only depend on the row's index label ix.
+        """
+        return {}
+
+    def column_meta(self, ser_ix):
+        """
+        Returns the fields of the objects in a column of self.df that only depend on the column's label ser_ix.
+        """
+        return {}
+
+    def tidy_frame(self):
+        """
+        Reshapes self.df into a long frame with a row per valid value and the columns date, source, datatype, datapoint,
+        value and valuetype. row_meta and column_meta are only called once per row and column that has a valid value.
+        """
+        # stack by position so that duplicate labels and MultiIndexes don't matter
+        values = pd.DataFrame(self.df.values).stack(dropna=False)
+        text = values.astype(str).str.strip()
+        values = values[values.notnull() & ~text.isin(['', '.', 'na'])]
+        if self.value_scale != 1:
+            values = values * self.value_scale
+
+        tidy = values.rename('value').reset_index()
+        tidy.columns = ['row', 'column', 'value']
+        rows = tidy['row'].unique()
+        columns = tidy['column'].unique()
+        row_meta = pd.DataFrame([self.row_meta(self.df.index[i]) for i in rows], index=rows)
+        column_meta = pd.DataFrame([self.column_meta(self.df.columns[i]) for i in columns], index=columns)
+        tidy = tidy.join(row_meta, on='row').join(column_meta, on='column')
+        tidy['source'] = self.source
+        return tidy[['date', 'source', 'datatype', 'datapoint', 'value', 'valuetype']]
+
     def generate_json(self):
-        raise NotImplemented("generate_json must be implemented by child class.")
+        for body in self.tidy_frame().to_dict('records'):
+            yield body
 
     def get_base_frame(self, columns=None):
         # read sheet into dataframe
@@ -122,32 +169,41 @@ class DjangoImport(object):
         """
         print('No post processing to be performed.')
         
-    def save(self, delete_existing=True, query=None):
+    def parse(self):
         """
-        Adds the dataframe to the database via the Django ORM using self.generate_objects to generate Django objects.
-        
-        Parameters:
-            delete_existing: option to delete the existing items for this import
-            query: Django Q object filter of JCHSData objects to know what to delete before import. Default is everything with self.source.
+        Processes the sheet and returns the json of every object to save as a list. Does not touch the database, so that
+        sheets can be parsed in worker processes.
         """
         if self.df is None:
             self.process_frame()
         if self.df is None:
             raise Exception("self.df has not been set, nothing to add to database.")
+        return list(self.generate_json())
+
+    def save(self, delete_existing=True, query=None, rows=None):
+        """
+        Adds the dataframe to the database with copy_rows.
+        
+        Parameters:
+            delete_existing: option to delete the existing items for this import
+            query: Django Q object filter of JCHSData objects to know what to delete before import. Default is everything with self.source.
+            rows: json of the objects to add as returned by self.parse. Default is to parse the sheet.
+        """
+        if rows is None:
+            rows = self.parse()
             
+        qs = None
         if delete_existing:
             if query is None:
                 qs = self.get_queryset()
             else:
                 qs = JCHSData.objects.filter(query)
-            # delete existing items in index
-            qs.delete()
 
-        # add new items
-        results = JCHSData.objects.bulk_create(self.generate_objects())
+        # only the rows that changed are deleted and added, in the same transaction
+        result_ct = copy_rows(JCHSData, rows, replace=qs, diff=True)
         pp_results = self.post_process()
-        result_ct = len(results)
         if pp_results:
+            DatasetVersion.objects.bump(JCHSData)
             result_ct += pp_results
         return result_ct
         
@@ -165,42 +221,34 @@ class ImportA1(DjangoImport):
         self.df.loc[:, (slice(None), 'Thousands', slice(None))] = self.df.loc[:, (slice(None), 'Thousands', slice(None))] * 1000
         self.df.loc[:, (slice(None), 'Millions of 2016 dollars', slice(None))] = self.df.loc[:, (slice(None), 'Millions of 2016 dollars', slice(None))] * 1000000
         self.df = self.df.dropna(how='all', subset=[('Permits','Thousands','Multifamily')])
-        
-    def generate_json(self):
-        for ix, row in self.df.iterrows():
 
-            for ser_ix, val in row.iteritems():
-                if not self.is_valid_value(val):
-                    continue
-                key = '{} {}'.format(ser_ix[2], ser_ix[0])
-                value_type = ser_ix[1]
-                value_type = value_type.replace('Millions of', '')
-                value_type = value_type.strip().lower()
-                if value_type == 'thousands':
-                    value_type = 'count'
-                time = datetime(ix, 1, 1, tzinfo=pytz.utc)
-                body = { 'date': time.astimezone(pacific), 'source': self.source, 'datatype': key, 'datapoint': 'United States', 'value': val, 'valuetype': value_type }
-                yield body
+    def row_meta(self, ix):
+        return { 'date': year_date(ix), 'datapoint': 'United States' }
+
+    def column_meta(self, ser_ix):
+        key = '{} {}'.format(ser_ix[2], ser_ix[0])
+        value_type = ser_ix[1]
+        value_type = value_type.replace('Millions of', '')
+        value_type = value_type.strip().lower()
+        if value_type == 'thousands':
+            value_type = 'count'
+        return { 'datatype': key, 'valuetype': value_type }
 
 
 # A-2
 class ImportA2(DjangoImport):
+    value_scale = 1000
+
     def process_frame(self):
         self.df = self.get_base_frame()
         self.add_sections_to_index()
         self.df.index = [x.split(';')[0] + ', Income ' + ' '.join(x.split(';')[1:]) for x in self.df.index]
-        
-    def generate_json(self):
-        for ix, row in self.df.iterrows():
 
-            for ser_ix, val in row.iteritems():
-                if not self.is_valid_value(val):
-                    continue
-                val = val * 1000
-                key = ix
-                time = datetime(ser_ix[0], 1, 1, tzinfo=pytz.utc)
-                body = { 'date': time.astimezone(pacific), 'source': self.source, 'datatype': ser_ix[1] + ' Households', 'datapoint': key, 'value': val, 'valuetype': 'count' }
-                yield body
+    def row_meta(self, ix):
+        return { 'datapoint': ix }
+
+    def column_meta(self, ser_ix):
+        return { 'date': year_date(ser_ix[0]), 'datatype': ser_ix[1] + ' Households', 'valuetype': 'count' }
 
 
 # W-1
@@ -210,17 +258,12 @@ class ImportW1(DjangoImport):
         self.add_sections_to_index()
         self.df.index = [x.split(';')[0].split(':')[0].replace(' Neighborhoods', '') + ', ' + ' '.join(x.split(';')[1:]) + ' Neighborhoods' for x in self.df.index]
         self.df.dropna(subset=[('Number of Neighborhoods', 2015)], inplace=True)
-        
-    def generate_json(self):
-        for ix, row in self.df.iterrows():
 
-            for ser_ix, val in row.iteritems():
-                if pd.isnull(val):
-                    continue
-                key = ix
-                time = datetime(ser_ix[1], 1, 1, tzinfo=pytz.utc)
-                body = { 'date': time.astimezone(pacific), 'source': self.source, 'datatype': ser_ix[0], 'datapoint': key, 'value': val, 'valuetype': 'count' }
-                yield body
+    def row_meta(self, ix):
+        return { 'datapoint': ix }
+
+    def column_meta(self, ser_ix):
+        return { 'date': year_date(ser_ix[1]), 'datatype': ser_ix[0], 'valuetype': 'count' }
 
 
 # W-2
@@ -231,19 +274,15 @@ class ImportW2(DjangoImport):
         self.df = self.df.loc[pd.notnull(self.df.index), :]
         self.df = self.df.loc[self.df.index.map(lambda x: 'Share of' not in x and 'Growth' not in x)]
 
-    def generate_json(self):
-        for ix, row in self.df.iterrows():
+    def row_meta(self, ix):
+        keys = ix.split(' ')
+        key = keys[0]
+        if key == 'Households':
+            key = 'All'
+        return { 'date': year_date(keys[-1]), 'datatype': key + ' Households by Nativity' }
 
-            for ser_ix, val in row.iteritems():
-                if not self.is_valid_value(val):
-                    continue
-                keys = ix.split(' ')
-                key = keys[0]
-                if key == 'Households':
-                    key = 'All'
-                time = datetime(int(keys[-1]), 1, 1, tzinfo=pytz.utc)
-                body = { 'date': time.astimezone(pacific), 'source': self.source, 'datatype': key + ' Households by Nativity', 'datapoint': ser_ix, 'value': val, 'valuetype': 'count' }
-                yield body
+    def column_meta(self, ser_ix):
+        return { 'datapoint': ser_ix, 'valuetype': 'count' }
 
 
 # W-3
@@ -252,16 +291,12 @@ class ImportW3(DjangoImport):
         self.df = self.get_base_frame(columns=5)
         self.df.dropna(how='all', inplace=True)
         self.df = self.df.loc[pd.notnull(self.df.index), :]
-        
-    def generate_json(self):
-        for ix, row in self.df.iterrows():
 
-            for ser_ix, val in row.iteritems():
-                if pd.isnull(val):
-                    continue
-                time = datetime(ix, 1, 1, tzinfo=pytz.utc)
-                body = { 'date': time.astimezone(pacific), 'source': self.source, 'datatype': 'Average Real Household Incomes by Income Quintile', 'datapoint': ser_ix, 'value': val, 'valuetype': '2015 dollars' }
-                yield body
+    def row_meta(self, ix):
+        return { 'date': year_date(ix) }
+
+    def column_meta(self, ser_ix):
+        return { 'datatype': 'Average Real Household Incomes by Income Quintile', 'datapoint': ser_ix, 'valuetype': '2015 dollars' }
 
 
 # W-4
@@ -270,42 +305,34 @@ class ImportW4(DjangoImport):
         self.df = self.get_base_frame()
         self.df.dropna(how='all', inplace=True)
         self.df = self.df.loc[pd.notnull(self.df.index), :]
-        
-    def generate_json(self):
-        for ix, row in self.df.iterrows():
 
-            for ser_ix, val in row.iteritems():
-                if not self.is_valid_value(val):
-                    continue
-                dp = ser_ix[1]
-                if ser_ix[0] == 'All Households':
-                    dp = ser_ix[0]
-                time = datetime(ix, 1, 1, tzinfo=pytz.utc)
-                body = { 'date': time.astimezone(pacific), 'source': self.source, 'datatype': 'Homeownership Rates by Age, Race/Ethnicity, and Region', 'datapoint': dp, 'value': val, 'valuetype': 'percent' }
-                yield body
+    def row_meta(self, ix):
+        return { 'date': year_date(ix) }
+
+    def column_meta(self, ser_ix):
+        dp = ser_ix[1]
+        if ser_ix[0] == 'All Households':
+            dp = ser_ix[0]
+        return { 'datatype': 'Homeownership Rates by Age, Race/Ethnicity, and Region', 'datapoint': dp, 'valuetype': 'percent' }
 
 
 # W-5
 class ImportW5(DjangoImport):
+    value_scale = 1000
+
     def process_frame(self):
         self.df = self.get_base_frame()
         self.df.index = ['All Households' if pd.isnull(x) else x for x in self.df.index]
         self.add_sections_to_index(delim=": ")
-        
-    def generate_json(self):
-        for ix, row in self.df.iterrows():
 
-            for ser_ix, val in row.iteritems():
-                if pd.isnull(val):
-                    continue
-                val = val * 1000
-                key = ser_ix[0]
-                if key == 'All Households':
-                    key = 'Households'
-                dp = ix
-                time = datetime(2015, 1, 1, tzinfo=pytz.utc)
-                body = { 'date': time.astimezone(pacific), 'source': self.source, 'datatype': ser_ix[1] + ' ' + key, 'datapoint': dp, 'value': val, 'valuetype': 'count' }
-                yield body
+    def row_meta(self, ix):
+        return { 'date': year_date(2015), 'datapoint': ix }
+
+    def column_meta(self, ser_ix):
+        key = ser_ix[0]
+        if key == 'All Households':
+            key = 'Households'
+        return { 'datatype': ser_ix[1] + ' ' + key, 'valuetype': 'count' }
 
 
 # W-6
@@ -313,23 +340,18 @@ class ImportW6(DjangoImport):
     def process_frame(self):
         self.df = self.get_base_frame()
         self.add_sections_to_index(delim=": ")
-        
-    def generate_json(self):
-        for ix, row in self.df.iterrows():
 
-            for ser_ix, val in row.iteritems():
-                if not self.is_valid_value(val):
-                    continue
-                key = ser_ix[0]
-                if key == 'Non-Housing Expenditures':
-                    key = ser_ix[1].replace('\n', '') + ' Expenditures'
-                key = 'Monthly ' + key
-                dp = ix
-                dp = re.sub('\s\(.+\)', '', dp)
-                dp = '{} {} {}'.format('Total Expenditures', dp, 'Share of Expenditures on Housing')
-                time = datetime(2015, 1, 1, tzinfo=pytz.utc)
-                body = { 'date': time.astimezone(pacific), 'source': self.source, 'datatype': key, 'datapoint': dp, 'value': val, 'valuetype': '2015 dollars' }
-                yield body
+    def row_meta(self, ix):
+        dp = re.sub('\s\(.+\)', '', ix)
+        dp = '{} {} {}'.format('Total Expenditures', dp, 'Share of Expenditures on Housing')
+        return { 'date': year_date(2015), 'datapoint': dp }
+
+    def column_meta(self, ser_ix):
+        key = ser_ix[0]
+        if key == 'Non-Housing Expenditures':
+            key = ser_ix[1].replace('\n', '') + ' Expenditures'
+        key = 'Monthly ' + key
+        return { 'datatype': key, 'valuetype': '2015 dollars' }
 
 
 # W-7
@@ -338,26 +360,21 @@ class ImportW7(DjangoImport):
         self.df = self.get_base_frame()
         # remove \n from columns headers
         self.df = self.df.rename(columns=lambda x: x.replace('\n', '').strip())
-        
-    def generate_json(self):
-        for ix, row in self.df.iterrows():
 
-            for ser_ix, val in row.iteritems():
-                if pd.isnull(val) or str(val).strip() == '':
-                    continue
-                time = ser_ix[2]
-                key = ser_ix[0][:-1]
-                if key == 'Percent Change in Home Prices':
-                    key = ser_ix[1] + ' ' + key
-                    key += ' from ' + time
-                dp = ix.replace('Metro Area', '').strip()
-                time = datetime(2016, 12, 1, tzinfo=pytz.utc)
-                body = { 'date': time.astimezone(pacific), 'source': self.source, 'datatype': key, 'datapoint': dp, 'value': val, 'valuetype': 'percent change' }
-                if ser_ix[1] == 'Real':
-                    body['valuetype'] = 'percent change, 2016 dollars'
-                elif ser_ix[0] == 'Median Home Value':
-                    body['valuetype'] = '2016 dollars'
-                yield body
+    def row_meta(self, ix):
+        return { 'date': year_date(2016, 12), 'datapoint': ix.replace('Metro Area', '').strip() }
+
+    def column_meta(self, ser_ix):
+        key = ser_ix[0][:-1]
+        if key == 'Percent Change in Home Prices':
+            key = ser_ix[1] + ' ' + key
+            key += ' from ' + ser_ix[2]
+        value_type = 'percent change'
+        if ser_ix[1] == 'Real':
+            value_type = 'percent change, 2016 dollars'
+        elif ser_ix[0] == 'Median Home Value':
+            value_type = '2016 dollars'
+        return { 'datatype': key, 'valuetype': value_type }
 
 
 # W-8
@@ -365,22 +382,17 @@ class ImportW8(DjangoImport):
     def process_frame(self):
         self.df = self.get_base_frame(columns=[1,2,3,4,5,6,7,8,9])
         self.df.dropna(how='all', inplace=True)
-        
-    def generate_json(self):
-        for ix, row in self.df.iterrows():
 
-            for ser_ix, val in row.iteritems():
-                if not self.is_valid_value(val):
-                    continue
-                key = ser_ix[0]
-                value_type = 'percent'
-                if key == 'Median Rent (Dollars)':
-                    key = 'Median Rent'
-                    value_type = '2015 dollars'
-                dp = ix.strip()
-                time = datetime(2015, 1, 1, tzinfo=pytz.utc)
-                body = { 'date': time.astimezone(pacific), 'source': self.source, 'datatype': key, 'datapoint': dp, 'value': val, 'valuetype': value_type }
-                yield body
+    def row_meta(self, ix):
+        return { 'date': year_date(2015), 'datapoint': ix.strip() }
+
+    def column_meta(self, ser_ix):
+        key = ser_ix[0]
+        value_type = 'percent'
+        if key == 'Median Rent (Dollars)':
+            key = 'Median Rent'
+            value_type = '2015 dollars'
+        return { 'datatype': key, 'valuetype': value_type }
 
 
 # W-9
@@ -388,18 +400,12 @@ class ImportW9(DjangoImport):
     def process_frame(self):
         self.df = self.get_base_frame()
         self.df.dropna(how='all', inplace=True)
-        
-    def generate_json(self):
-        for ix, row in self.df.iterrows():
 
-            for ser_ix, val in row.iteritems():
-                if not self.is_valid_value(val):
-                    continue
-                key = 'Monthly Mortgage Payment on Median Priced Home'
-                dp = ix.strip()
-                time = datetime(ser_ix, 1, 1, tzinfo=pytz.utc)
-                body = { 'date': time.astimezone(pacific), 'source': self.source, 'datatype': key, 'datapoint': dp, 'value': val, 'valuetype': '2016 dollars' }
-                yield body
+    def row_meta(self, ix):
+        return { 'datapoint': ix.strip() }
+
+    def column_meta(self, ser_ix):
+        return { 'date': year_date(ser_ix), 'datatype': 'Monthly Mortgage Payment on Median Priced Home', 'valuetype': '2016 dollars' }
 
 
 # W-10
@@ -407,24 +413,18 @@ class ImportW10(DjangoImport):
     def process_frame(self):
         self.df = self.get_base_frame()
         self.df.dropna(how='all', inplace=True)
-        
-    def generate_json(self):
-        for ix, row in self.df.iterrows():
 
-            for ser_ix, val in row.iteritems():
-                if not self.is_valid_value(val):
-                    continue
-                txt = ' Able to Afford Monthly Payments on Median Priced Homes in Their Metro Area'
-                value_type = '2015 dollars'
-                key = ser_ix
-                key = re.sub('\s\(.+\)', '', key).strip()
-                if key in ['Share of All Households','Share of Renters']:
-                    key += txt
-                    value_type = 'percent'
-                dp = ix.strip()
-                time = datetime(2015, 1, 1, tzinfo=pytz.utc)
-                body = { 'date': time.astimezone(pacific), 'source': self.source, 'datatype': key, 'datapoint': dp, 'value': val, 'valuetype': value_type }
-                yield body
+    def row_meta(self, ix):
+        return { 'date': year_date(2015), 'datapoint': ix.strip() }
+
+    def column_meta(self, ser_ix):
+        txt = ' Able to Afford Monthly Payments on Median Priced Homes in Their Metro Area'
+        value_type = '2015 dollars'
+        key = re.sub('\s\(.+\)', '', ser_ix).strip()
+        if key in ['Share of All Households','Share of Renters']:
+            key += txt
+            value_type = 'percent'
+        return { 'datatype': key, 'valuetype': value_type }
 
 
 # W-11
@@ -432,18 +432,12 @@ class ImportW11(DjangoImport):
     def process_frame(self):
         self.df = self.get_base_frame()
         self.df.dropna(how='all', inplace=True)
-        
-    def generate_json(self):
-        for ix, row in self.df.iterrows():
 
-            for ser_ix, val in row.iteritems():
-                if not self.is_valid_value(val):
-                    continue
-                key = 'Median Payment-to-Income Ratio'
-                dp = ix.strip()
-                time = datetime(ser_ix, 1, 1, tzinfo=pytz.utc)
-                body = { 'date': time.astimezone(pacific), 'source': self.source, 'datatype': key, 'datapoint': dp, 'value': val, 'valuetype': 'ratio' }
-                yield body
+    def row_meta(self, ix):
+        return { 'datapoint': ix.strip() }
+
+    def column_meta(self, ser_ix):
+        return { 'date': year_date(ser_ix), 'datatype': 'Median Payment-to-Income Ratio', 'valuetype': 'ratio' }
 
 
 # W-12
@@ -451,18 +445,12 @@ class ImportW12(DjangoImport):
     def process_frame(self):
         self.df = self.get_base_frame()
         self.df.dropna(how='all', inplace=True)
-        
-    def generate_json(self):
-        for ix, row in self.df.iterrows():
 
-            for ser_ix, val in row.iteritems():
-                if not self.is_valid_value(val):
-                    continue
-                key = 'Median Home Price-to-Median Income Ratio'
-                dp = ix.strip()
-                time = datetime(ser_ix, 1, 1, tzinfo=pytz.utc)
-                body = { 'date': time.astimezone(pacific), 'source': self.source, 'datatype': key, 'datapoint': dp, 'value': val, 'valuetype': 'ratio' }
-                yield body
+    def row_meta(self, ix):
+        return { 'datapoint': ix.strip() }
+
+    def column_meta(self, ser_ix):
+        return { 'date': year_date(ser_ix), 'datatype': 'Median Home Price-to-Median Income Ratio', 'valuetype': 'ratio' }
 
 
 # W-13
@@ -470,24 +458,19 @@ class ImportW13(DjangoImport):
     def process_frame(self):
         self.df = self.get_base_frame()
         self.df.dropna(how='all', inplace=True)
-        
-    def generate_json(self):
-        for ix, row in self.df.iterrows():
 
-            for ser_ix, val in row.iteritems():
-                if not self.is_valid_value(val):
-                    continue
-                dp = ix.strip()
-                value_type = ser_ix[0]
-                key = '{} {}'.format(ser_ix[2], ser_ix[1])
-                if value_type == 'Number of Households (Thousands)':
-                    value_type = 'count'
-                else:
-                    value_type = 'percent'
-                    key += ', Share of All Households'
-                time = datetime(2015, 1, 1, tzinfo=pytz.utc)
-                body = { 'date': time.astimezone(pacific), 'source': self.source, 'datatype': key, 'datapoint': dp, 'value': val, 'valuetype': value_type }
-                yield body
+    def row_meta(self, ix):
+        return { 'date': year_date(2015), 'datapoint': ix.strip() }
+
+    def column_meta(self, ser_ix):
+        value_type = ser_ix[0]
+        key = '{} {}'.format(ser_ix[2], ser_ix[1])
+        if value_type == 'Number of Households (Thousands)':
+            value_type = 'count'
+        else:
+            value_type = 'percent'
+            key += ', Share of All Households'
+        return { 'datatype': key, 'valuetype': value_type }
 
 
 # W-14
@@ -495,22 +478,17 @@ class ImportW14(DjangoImport):
     def process_frame(self):
         self.df = self.get_base_frame()
         self.df.dropna(how='all', inplace=True)
-        
-    def generate_json(self):
-        for ix, row in self.df.iterrows():
 
-            for ser_ix, val in row.iteritems():
-                if not self.is_valid_value(val):
-                    continue
-                dp = ix.strip()
-                value_type = 'percent'
-                key = '{}, {} Households, Income {}'.format(re.sub('\s\(.+\)', '', ser_ix[0]), ser_ix[2], ser_ix[1])
-                if ser_ix[0] == 'Median for All Income Groups':
-                    key = ser_ix[2] + ', ' + ser_ix[0]
-                    value_type = ser_ix[1].lower().strip()
-                time = datetime(2015, 1, 1, tzinfo=pytz.utc)
-                body = { 'date': time.astimezone(pacific), 'source': self.source, 'datatype': key, 'datapoint': dp, 'value': val, 'valuetype': value_type }
-                yield body
+    def row_meta(self, ix):
+        return { 'date': year_date(2015), 'datapoint': ix.strip() }
+
+    def column_meta(self, ser_ix):
+        value_type = 'percent'
+        key = '{}, {} Households, Income {}'.format(re.sub('\s\(.+\)', '', ser_ix[0]), ser_ix[2], ser_ix[1])
+        if ser_ix[0] == 'Median for All Income Groups':
+            key = ser_ix[2] + ', ' + ser_ix[0]
+            value_type = ser_ix[1].lower().strip()
+        return { 'datatype': key, 'valuetype': value_type }
 
 
 # W-15
@@ -518,21 +496,15 @@ class ImportW15(DjangoImport):
     def process_frame(self):
         self.df = self.get_base_frame()
         self.df.dropna(how='all', inplace=True)
-        
-    def generate_json(self):
-        for ix, row in self.df.iterrows():
 
-            for ser_ix, val in row.iteritems():
-                if not self.is_valid_value(val):
-                    continue
-                dp = ix.strip()
-                value_type = 'count'
-                key = '{} {}'.format(ser_ix[2], ser_ix[0].replace('Number of ', '').replace('Total Population in ', ''))
-                if 'Total Population' in ser_ix[0]:
-                    key = 'Total Population in ' + key
-                time = datetime(ser_ix[1], 1, 1, tzinfo=pytz.utc)
-                body = { 'date': time.astimezone(pacific), 'source': self.source, 'datatype': key, 'datapoint': dp, 'value': val, 'valuetype': value_type }
-                yield body
+    def row_meta(self, ix):
+        return { 'datapoint': ix.strip() }
+
+    def column_meta(self, ser_ix):
+        key = '{} {}'.format(ser_ix[2], ser_ix[0].replace('Number of ', '').replace('Total Population in ', ''))
+        if 'Total Population' in ser_ix[0]:
+            key = 'Total Population in ' + key
+        return { 'date': year_date(ser_ix[1]), 'datatype': key, 'valuetype': 'count' }
 
 
 # W-16
@@ -543,33 +515,28 @@ class ImportW16(DjangoImport):
         # remove \n from columns headers
         self.df = self.df.rename(columns=lambda x: x.replace('\n', ' ').strip())
         self.df.set_index([('Metropolitan Area Name', 'Unnamed: 1_level_1')], append=True, inplace=True)
-        
-    def generate_json(self):
-        for ix, row in self.df.iterrows():
-            for ser_ix, val in row.iteritems():
-                if not self.is_valid_value(val):
-                    continue
-                dp = ix[1].strip()
-                key = re.sub('\s\(.+\)', '', ser_ix[0])
-                if key == 'Population Rank in 2015':
-                    value_type = 'rank'
-                elif key == 'Share of Units by Real Rent Level':
-                    value_type = 'percent'
-                elif key == 'Change in Share of Units by Real Rent Level, 2005–2015':
-                    value_type = 'percentage points'
-                elif key == 'Estimated Number of Renter Households by Rent Level':
-                    value_type = 'count'
-                elif key == 'Sample Size':
-                    value_type = 'count'
-                else:
-                    raise Exception("No value_type found.")
-
-                if key in ['Share of Units by Real Rent Level','Estimated Number of Renter Households by Rent Level','Change in Share of Units by Real Rent Level, 2005–2015']:
-                    key = '{}, Real Gross Rents {}'.format(key, ser_ix[1])                
-                    
-                time = datetime(ix[0], 1, 1, tzinfo=pytz.utc)
-                body = { 'date': time.astimezone(pacific), 'source': self.source, 'datatype': key, 'datapoint': dp, 'value': val, 'valuetype': value_type }
-                yield body
+
+    def row_meta(self, ix):
+        return { 'date': year_date(ix[0]), 'datapoint': ix[1].strip() }
+
+    def column_meta(self, ser_ix):
+        key = re.sub('\s\(.+\)', '', ser_ix[0])
+        if key == 'Population Rank in 2015':
+            value_type = 'rank'
+        elif key == 'Share of Units by Real Rent Level':
+            value_type = 'percent'
+        elif key == 'Change in Share of Units by Real Rent Level, 2005–2015':
+            value_type = 'percentage points'
+        elif key == 'Estimated Number of Renter Households by Rent Level':
+            value_type = 'count'
+        elif key == 'Sample Size':
+            value_type = 'count'
+        else:
+            raise Exception("No value_type found.")
+
+        if key in ['Share of Units by Real Rent Level','Estimated Number of Renter Households by Rent Level','Change in Share of Units by Real Rent Level, 2005–2015']:
+            key = '{}, Real Gross Rents {}'.format(key, ser_ix[1])
+        return { 'datatype': key, 'valuetype': value_type }
 
     def post_process(self):
         print('Running post_process for W-16')
@@ -616,17 +583,12 @@ class ImportW17(DjangoImport):
         # remove \n from columns headers
         self.df = self.df.rename(columns=lambda x: x.replace('\n', ' ').strip())
         self.df.set_index(['Continuum of Care'], append=True, inplace=True)
-        
-    def generate_json(self):
-        for ix, row in self.df.iterrows():
 
-            for ser_ix, val in row.iteritems():
-                if not self.is_valid_value(val):
-                    continue
-                dp = ix[0].strip()
-                time = datetime(int(ser_ix.split(', ')[1]), 1, 1, tzinfo=pytz.utc)
-                body = { 'date': time.astimezone(pacific), 'source': self.source, 'datatype': 'Continuum of Care Homelessness', 'datapoint': dp, 'value': val, 'valuetype': 'count' }
-                yield body
+    def row_meta(self, ix):
+        return { 'datapoint': ix[0].strip() }
+
+    def column_meta(self, ser_ix):
+        return { 'date': year_date(ser_ix.split(', ')[1]), 'datatype': 'Continuum of Care Homelessness', 'valuetype': 'count' }
 
 
 # W-18
@@ -636,60 +598,97 @@ class ImportW18(DjangoImport):
         self.df.dropna(how='all', inplace=True)
         # remove \n from columns headers
         self.df = self.df.rename(columns=lambda x: x.replace('\n', ' ').strip())
-        
-    def generate_json(self):
-        for ix, row in self.df.iterrows():
 
-            for ser_ix, val in row.iteritems():
-                if not self.is_valid_value(val):
-                    continue
-                dp = ix.strip()
-                key = re.sub('\s\(.+\)', '', ser_ix)
-                data_type = key.split(', ')[0]
-                year = int(key.split(', ')[-1])
-                value_type = 'count'
-                if 'Percent' in ser_ix:
-                    value_type = 'percent'
-                time = datetime(year, 1, 1, tzinfo=pytz.utc)
-                body = { 'date': time.astimezone(pacific), 'source': self.source, 'datatype': data_type, 'datapoint': dp, 'value': val, 'valuetype': value_type }
-                yield body
-
-def load_data():
-    file_path = '/data/all_son_2017_tables_current_6_12_17.xlsx'
+    def row_meta(self, ix):
+        return { 'datapoint': ix.strip() }
+
+    def column_meta(self, ser_ix):
+        key = re.sub('\s\(.+\)', '', ser_ix)
+        value_type = 'count'
+        if 'Percent' in ser_ix:
+            value_type = 'percent'
+        return { 'date': year_date(key.split(', ')[-1]), 'datatype': key.split(', ')[0], 'valuetype': value_type }
+
+# import class of every sheet
+import_classes = {
+    'A-1': ImportA1,
+    'A-2': ImportA2,
+    'W-1': ImportW1,
+    'W-2': ImportW2,
+    'W-3': ImportW3,
+    'W-4': ImportW4,
+    'W-5': ImportW5,
+    'W-6': ImportW6,
+    'W-7': ImportW7,
+    'W-8': ImportW8,
+    'W-9': ImportW9,
+    'W-10': ImportW10,
+    'W-11': ImportW11,
+    'W-12': ImportW12,
+    'W-13': ImportW13,
+    'W-14': ImportW14,
+    'W-15': ImportW15,
+    'W-16': ImportW16,
+    'W-17': ImportW17,
+    'W-18': ImportW18,
+}
+
+# workbook opened once by each worker process
+workbook = None
+
+def parse_sheet(file_path, source):
+    """
+    Parses a sheet of the workbook at file_path. Runs in a worker process, which opens the workbook the first time it
+    parses a sheet and reuses it for the sheets after.
+
+    Returns: (source, json of the objects to save, hash of the json, seconds spent parsing)
+    """
+    global workbook
+    start = timer()
+    if workbook is None:
+        workbook = pd.ExcelFile(file_path)
+    rows = import_classes[source](source=source, data_file=workbook).parse()
+    return source, rows, rows_hash(rows), timer() - start
+
+def load_data(max_workers=None, full=False):
+    """
+    Loads the sheets that changed since the last load, parsing them in parallel in a pool of max_workers processes
+    (default one per core) while the parsed rows are saved one sheet at a time by this process.
+
+    Parameters:
+        max_workers: number of worker processes
+        full: reload every sheet into a shadow table even if the workbook is unchanged
+    """
+    file_name = 'all_son_2017_tables_current_6_12_17.xlsx'
+    file_path = '/data/' + file_name
     if not os.path.isfile(file_path):
         s3.Bucket(BUCKET_NAME ).download_file(KEY, file_path)
 
-    with pd.ExcelFile(file_path) as xlsx:
-        a1 = ImportA1(source='A-1', data_file=xlsx)
-        a2 = ImportA2(source='A-2', data_file=xlsx)
-        w1 = ImportW1(source='W-1', data_file=xlsx)
-        w2 = ImportW2(source='W-2', data_file=xlsx)
-        w3 = ImportW3(source='W-3', data_file=xlsx)
-        w4 = ImportW4(source='W-4', data_file=xlsx)
-        w5 = ImportW5(source='W-5', data_file=xlsx)
-        w6 = ImportW6(source='W-6', data_file=xlsx)
-        w7 = ImportW7(source='W-7', data_file=xlsx)
-        w8 = ImportW8(source='W-8', data_file=xlsx)
-        w9 = ImportW9(source='W-9', data_file=xlsx)
-        w10 = ImportW10(source='W-10', data_file=xlsx)
-        w11 = ImportW11(source='W-11', data_file=xlsx)
-        w12 = ImportW12(source='W-12', data_file=xlsx)
-        w13 = ImportW13(source='W-13', data_file=xlsx)
-        w14 = ImportW14(source='W-14', data_file=xlsx)
-        w15 = ImportW15(source='W-15', data_file=xlsx)
-        w16 = ImportW16(source='W-16', data_file=xlsx)
-        w17 = ImportW17(source='W-17', data_file=xlsx)
-        w18 = ImportW18(source='W-18', data_file=xlsx)
-
-        # put all the imports into a list
-        imports = [a1,a2,w1,w2,w3,w4,w5,w6,w7,w8,w9,w10,w11,w12,w13,w14,w15,w16,w17,w18]
-
-        # run import methods on them
-        ct = 0
-        for i in imports:
-            print('processing sheet ' + i.source)
-            result = i.save()
-            ct += result
-
-    print('Inserted {} rows'.format(ct))
-
+    hashes = {file_name: file_hash(file_path)}
+    if not full and not LoadManifest.objects.changed(JCHSData, hashes, version=LOADER_VERSION):
+        print('{} is unchanged'.format(file_name))
+        return
+
+    # worker processes must not share the database connections of this one
+    connections.close_all()
+
+    ct = 0
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(parse_sheet, file_path, source) for source in import_classes]
+        # the pool is started first so that no connection is closed while the shadow table is on the search_path
+        with load_scope(JCHSData, full=full):
+            for future in as_completed(futures):
+                source, rows, sheet_hash, parse_time = future.result()
+                if not full and not LoadManifest.objects.changed(JCHSData, {source: sheet_hash}, version=LOADER_VERSION):
+                    print('sheet {}: unchanged'.format(source))
+                    continue
+                hashes[source] = sheet_hash
+                start = timer()
+                result = import_classes[source](source=source, data_file=None).save(rows=rows)
+                ct += result
+                print('sheet {}: parsed {} rows in {:.1f}s, saved {} rows in {:.1f}s'.format(source, len(rows), parse_time, result, timer() - start))
+
+            print('Loaded {} rows'.format(ct))
+            print('Ranked {} rows'.format(JCHSData.objects.refresh_rank()))
+    LoadManifest.objects.record(JCHSData, hashes, version=LOADER_VERSION, replace=full)
+    build_catalog(JCHSData, JCHS_FACET_FIELDS)
@@ -0,0 +1,38 @@
+import hashlib
+import json
+from django.db import router, transaction
+from data.loaders.shadow import shadow_load
+
+# size of the blocks source files are hashed in
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def file_hash(*paths):
+    """
+    Returns the SHA-256 of the contents of the files, in order, e.g. all the files of a shapefile.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+def rows_hash(rows):
+    """
+    Returns the SHA-256 of rows of field values as parsed by a loader, for partitions that are part of a larger
+    source file, e.g. a sheet of a workbook that has other sheets changed.
+    """
+    digest = hashlib.sha256()
+    for row in rows:
+        digest.update(json.dumps(row, sort_keys=True, default=str).encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+def load_scope(*models, full=False):
+    """
+    Returns the context manager a load of models runs in. A full reload goes into shadow tables with shadow_load, an
+    incremental one runs in a transaction so that the changed partitions are replaced together.
+    """
+    if full:
+        return shadow_load(*models)
+    return transaction.atomic(using=router.db_for_write(models[0]))
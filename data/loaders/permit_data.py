@@ -1,8 +1,13 @@
 import os
 from django.contrib.gis.utils import LayerMapping
-from api.models import PermitData
+from api.models import LoadManifest, PermitData, PermitRollup
+from data.loaders.copy_loader import copy_rows, layer_rows
+from data.loaders.manifest import file_hash, load_scope
 import boto3
 
+# bumped when the way the source is parsed changes, so that every partition is reloaded
+LOADER_VERSION = 1
+
 mapping = {
     'in_date': 'INDATE',
     'issue_date': 'ISSUEDATE',
@@ -32,7 +37,7 @@ mapping = {
     'point': 'POINT',
 }
 
-def run(verbose=True):
+def run(verbose=True, full=False):
     BUCKET_NAME = 'hacko-data-archive'
     KEY = '2018-housing-affordability/data/permits/'
     s3 = boto3.resource('s3')
@@ -43,7 +48,17 @@ def run(verbose=True):
         key = KEY + f
         s3.Bucket(BUCKET_NAME).download_file(key, file_path)
 
-    PermitData.objects.all().delete()
-    lm = LayerMapping(PermitData, file_path, mapping, transform=False, encoding='iso-8859-1')
-    lm.save(strict=True, verbose=verbose)
-    
+    hashes = {f: file_hash(file_path)}
+    if not full and not LoadManifest.objects.changed(PermitData, hashes, version=LOADER_VERSION):
+        print('{} is unchanged'.format(f))
+        return
+
+    # the permits are a single file, so only the permits that differ from the loaded ones are replaced
+    with load_scope(PermitData, full=full):
+        lm = LayerMapping(PermitData, file_path, mapping, transform=False, encoding='iso-8859-1')
+        replace = None if full else PermitData.objects.all()
+        count = copy_rows(PermitData, layer_rows(lm), replace=replace, diff=not full)
+        if verbose:
+            print('Loaded {} permits'.format(count))
+    LoadManifest.objects.record(PermitData, hashes, version=LOADER_VERSION, replace=True)
+    PermitRollup.objects.refresh()
@@ -1,9 +1,14 @@
 import pandas as pd
 import os
+from django.db import transaction
 from data.loaders.django_import import DjangoImport
-from api.models import Policy, Program
+from api.models import LoadManifest, Policy, Program
+from data.loaders.manifest import file_hash
 import boto3
 
+# bumped when the way the source is parsed changes, so that every partition is reloaded
+LOADER_VERSION = 1
+
 class PolicyImport(DjangoImport):
     django_model = Policy
 
@@ -42,6 +47,7 @@ class ProgramImport(DjangoImport):
         return self.django_model.objects.all()
 
     def generate_json(self):
+        policies = Policy.objects.in_bulk()
         for ix, row in self.data.iterrows():
             try:
                 name = row['Program_Name'].strip()
@@ -63,9 +69,8 @@ class ProgramImport(DjangoImport):
             except:
                 time = None
             
-            try:
-                policy = Policy.objects.get(pk=row['Policy_ID'])
-            except:
+            policy = policies.get(str(row['Policy_ID']))
+            if policy is None:
                 print(row['Policy_ID'])
                 continue
 
@@ -83,7 +88,7 @@ class ProgramImport(DjangoImport):
             yield body
 
 
-def load_data():
+def load_data(full=False):
     BUCKET_NAME = 'hacko-data-archive'
     KEY = '2018-housing-affordability/data/'
     s3 = boto3.resource('s3')
@@ -94,10 +99,18 @@ def load_data():
         key = KEY + f
         s3.Bucket(BUCKET_NAME).download_file(key, file_path)
 
+    hashes = {f: file_hash(file_path)}
+    if not full and not LoadManifest.objects.changed(Policy, hashes, version=LOADER_VERSION):
+        print('{} is unchanged'.format(f))
+        return
+
     with pd.ExcelFile(file_path) as xlsx:
         policies = PolicyImport(file_loc=xlsx)
         programs = ProgramImport(file_loc=xlsx)
 
-        policies.save()
-        programs.save()
+        # programs reference policies, so both tables are replaced in one transaction instead of swapped
+        with transaction.atomic():
+            policies.save()
+            programs.save()
+    LoadManifest.objects.record(Policy, hashes, version=LOADER_VERSION, replace=True)
     
@@ -0,0 +1,114 @@
+import re
+from contextlib import contextmanager
+from django.db import connections, router, transaction
+from api.models import DatasetVersion
+
+# schema the shadow tables are built in
+SHADOW_SCHEMA = 'loader_shadow'
+# schema the live tables are moved to when they are replaced, until they are dropped
+RETIRED_SCHEMA = 'loader_retired'
+
+def build_shadow_indexes(cursor, qn, table, shadow):
+    """
+    Recreates the primary key, unique constraints and indexes of table on its shadow, with the same names.
+    """
+    cursor.execute("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype IN ('p', 'u')", [table])
+    for name, definition in cursor.fetchall():
+        cursor.execute('ALTER TABLE {} ADD CONSTRAINT {} {}'.format(shadow, qn(name), definition))
+
+    # indexes backing the constraints above were created with them
+    cursor.execute('''
+        SELECT pg_get_indexdef(i.indexrelid) FROM pg_index i
+        WHERE i.indrelid = %s::regclass AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid)
+    ''', [table])
+    for definition, in cursor.fetchall():
+        cursor.execute(re.sub(r' ON (ONLY )?\S+ USING ', ' ON {} USING '.format(shadow), definition, count=1))
+
+def copy_privileges(cursor, qn, table, shadow):
+    """
+    Gives the shadow the owner and the privileges granted on table, which CREATE TABLE LIKE does not copy.
+    """
+    cursor.execute('SELECT pg_get_userbyid(relowner) FROM pg_class WHERE oid = %s::regclass', [table])
+    cursor.execute('ALTER TABLE {} OWNER TO {}'.format(shadow, qn(cursor.fetchone()[0])))
+    cursor.execute('''
+        SELECT a.privilege_type, CASE WHEN a.grantee = 0 THEN NULL ELSE pg_get_userbyid(a.grantee) END, a.is_grantable
+        FROM pg_class c, aclexplode(c.relacl) a WHERE c.oid = %s::regclass
+    ''', [table])
+    for privilege, grantee, grantable in cursor.fetchall():
+        cursor.execute('GRANT {} ON {} TO {}{}'.format(
+            privilege, shadow, 'PUBLIC' if grantee is None else qn(grantee), ' WITH GRANT OPTION' if grantable else ''))
+
+def drop_tables(cursor, qn, schema, models):
+    for model in models:
+        cursor.execute('DROP TABLE IF EXISTS {}.{}'.format(qn(schema), qn(model._meta.db_table)))
+
+@contextmanager
+def shadow_load(*models):
+    """
+    Context manager that reloads the tables of models without exposing partial data. Inside the block the tables are
+    replaced by empty shadow copies in SHADOW_SCHEMA, put first on the connection's search_path so that everything
+    the loader writes and reads goes to them. When the block exits, the indexes and constraints of the live tables
+    are built on the shadows, then in one transaction the shadows are given the owner and privileges of the live
+    tables, the live tables are moved aside to RETIRED_SCHEMA, the shadows are moved into their place and the
+    dataset versions are bumped. The retired tables are dropped after the swap is committed, so that queries that
+    were waiting on them still complete. If the block raises, the shadow tables are dropped and the live tables are
+    left untouched.
+
+    The models must not be referenced by foreign keys, since the constraints would follow the retired table.
+    """
+    db = router.db_for_write(models[0])
+    connection = connections[db]
+    qn = connection.ops.quote_name
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT current_schema()')
+        schema = cursor.fetchone()[0]
+        cursor.execute('SHOW search_path')
+        search_path = cursor.fetchone()[0]
+        for s in (SHADOW_SCHEMA, RETIRED_SCHEMA):
+            cursor.execute('CREATE SCHEMA IF NOT EXISTS {}'.format(qn(s)))
+            drop_tables(cursor, qn, s, models)
+        for model in models:
+            table = qn(model._meta.db_table)
+            # indexes are built after loading, which is much faster than maintaining them during it
+            cursor.execute('CREATE TABLE {s}.{t} (LIKE {live}.{t} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE)'.format(s=qn(SHADOW_SCHEMA), live=qn(schema), t=table))
+        cursor.execute('SET search_path TO {}, {}'.format(qn(SHADOW_SCHEMA), search_path))
+
+    try:
+        try:
+            yield
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute('SET search_path TO {}'.format(search_path))
+
+        with connection.cursor() as cursor:
+            for model in models:
+                table = qn(model._meta.db_table)
+                shadow = '{}.{}'.format(qn(SHADOW_SCHEMA), table)
+                build_shadow_indexes(cursor, qn, '{}.{}'.format(qn(schema), table), shadow)
+                cursor.execute('ANALYZE {}'.format(shadow))
+
+        with transaction.atomic(using=db), connection.cursor() as cursor:
+            for model in models:
+                table = qn(model._meta.db_table)
+                live = '{}.{}'.format(qn(schema), table)
+                cursor.execute('LOCK TABLE {} IN ACCESS EXCLUSIVE MODE'.format(live))
+                copy_privileges(cursor, qn, live, '{}.{}'.format(qn(SHADOW_SCHEMA), table))
+                # the id sequence is owned by the live table and would move with it
+                cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [live, model._meta.pk.column])
+                sequence = cursor.fetchone()[0]
+                if sequence:
+                    cursor.execute('ALTER SEQUENCE {} OWNED BY NONE'.format(sequence))
+                # moved rather than renamed, since the shadow's indexes and constraints have the same names
+                cursor.execute('ALTER TABLE {} SET SCHEMA {}'.format(live, qn(RETIRED_SCHEMA)))
+                cursor.execute('ALTER TABLE {}.{} SET SCHEMA {}'.format(qn(SHADOW_SCHEMA), table, qn(schema)))
+                if sequence:
+                    cursor.execute('ALTER SEQUENCE {} OWNED BY {}.{}'.format(sequence, live, qn(model._meta.pk.column)))
+                DatasetVersion.objects.bump(model)
+    except Exception:
+        with connection.cursor() as cursor:
+            drop_tables(cursor, qn, SHADOW_SCHEMA, models)
+        raise
+
+    with connection.cursor() as cursor:
+        drop_tables(cursor, qn, RETIRED_SCHEMA, models)
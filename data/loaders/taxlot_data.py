@@ -3,9 +3,14 @@ import shutil
 import requests
 from django.contrib.gis.utils import LayerMapping
 from django.db.models.signals import pre_save
-from api.models import TaxlotData
+from api.models import LoadManifest, TaxlotData, TaxlotRollup
+from data.loaders.copy_loader import copy_rows, layer_rows
+from data.loaders.manifest import file_hash, load_scope
 import boto3
 
+# bumped when the way the source is parsed changes, so that every partition is reloaded
+LOADER_VERSION = 1
+
 BUCKET_NAME = 'hacko-data-archive'
 KEY = '2018-housing-affordability/data/taxlots/shapefiles/'
 s3 = boto3.resource('s3')
@@ -43,42 +48,75 @@ mapping = {
     'mpoly': 'MULTIPOLYGON',
 }
 
-def run(verbose=False):
-    TaxlotData.objects.all().delete()
+def download_year(year):
+    """
+    Downloads the shapefile of a year unless it was downloaded before.
 
-    for year in years:
-        # Override field settings to add in year
-        class YearLayerMapping(LayerMapping):
-            def feature_kwargs(self, feat):
-                kwargs = super().feature_kwargs(feat)
-                kwargs['year'] = year
-                return kwargs
+    Returns: Paths of the shapefile's files
+    """
+    try:
+        TMP_LOCATION = '/data/taxlots/{}/'.format(year)
+        if not os.path.isdir(TMP_LOCATION):
+            os.makedirs(TMP_LOCATION)
+        
+        paths = []
+        for ext in ['shp','shx','dbf','prj','qpj']:
+            file_name = 'taxlots_Portland_sfr.{}'.format(ext)
+            file_path = TMP_LOCATION + file_name
+            if not os.path.isfile(file_path):
+                key = '{}/{}/{}'.format(KEY, year, file_name)
+                s3.Bucket(BUCKET_NAME).download_file(key, file_path)
+                print("Downloading " + key)
+            paths.append(file_path)
+        print("Finished downloading all files.")
+        print(os.listdir(TMP_LOCATION))
+        return paths
+
+    finally:
+        print("Not deleting downloaded files.")
+        #if os.path.isdir(TMP_LOCATION): 
+            #shutil.rmtree(TMP_LOCATION)
 
-        try:
-            TMP_LOCATION = '/data/taxlots/{}/'.format(year)
-            if not os.path.isdir(TMP_LOCATION):
-                os.makedirs(TMP_LOCATION)
-                
-            for ext in ['shp','shx','dbf','prj','qpj']:
-                file_name = 'taxlots_Portland_sfr.{}'.format(ext)
-                file_path = TMP_LOCATION + file_name
-                if not os.path.isfile(file_path):
-                    key = '{}/{}/{}'.format(KEY, year, file_name)
-                    s3.Bucket(BUCKET_NAME).download_file(key, file_path)
-                    print("Downloading " + key)
-            print("Finished downloading all files.")
-            print(os.listdir(TMP_LOCATION))
+def load_year(year, shapefile, full=False, verbose=False):
+    """
+    Loads the taxlots of a year with COPY. Unless full, only the taxlots that differ from those loaded for the year
+    are replaced, and only those get their simplified geometries computed.
+    """
+    m = mapping.copy()
+    if year in ['2005','2006']:
+        m.pop('owner_state')
+        m.pop('site_zip')
 
-            m = mapping.copy()
-            if year in ['2005','2006']:
-                m.pop('owner_state')
-                m.pop('site_zip')
+    lm = LayerMapping(TaxlotData, shapefile, m, transform=False, encoding='iso-8859-1')
+    replace = None if full else TaxlotData.objects.filter(year=year)
+    count = copy_rows(TaxlotData, layer_rows(lm, year=int(year)), replace=replace, diff=not full)
+    if verbose:
+        print('Loaded {} taxlots for {}'.format(count, year))
+    TaxlotData.objects.simplify(year=year, missing=not full)
+
+def run(verbose=False, full=False):
+    """
+    Loads the years whose shapefiles changed since the last load. Only the taxlots of a changed year that differ
+    from the loaded ones are replaced, in one transaction for all the years. With full every year is loaded into a
+    shadow table that replaces the live one once all are loaded.
+    """
+    shapefiles = {}
+    hashes = {}
+    for year in years:
+        paths = download_year(year)
+        shapefiles[year] = paths[0]
+        hashes[year] = file_hash(*paths)
 
-            lm = YearLayerMapping(TaxlotData, TMP_LOCATION + 'taxlots_Portland_sfr.shp', m, transform=False, encoding='iso-8859-1')
-            lm.save(strict=True, verbose=verbose)
+    if not full:
+        hashes = LoadManifest.objects.changed(TaxlotData, hashes, version=LOADER_VERSION)
+        if not hashes:
+            print("Taxlot shapefiles are unchanged.")
+            return
 
-        finally:
-            print("Not deleting downloaded files.")
-            #if os.path.isdir(TMP_LOCATION): 
-                #shutil.rmtree(TMP_LOCATION)
+    with load_scope(TaxlotData, full=full):
+        for year in hashes:
+            load_year(year, shapefiles[year], full=full, verbose=verbose)
+    LoadManifest.objects.record(TaxlotData, hashes, version=LOADER_VERSION, replace=full)
 
+    for year in hashes:
+        TaxlotRollup.objects.refresh(year)
@@ -1,8 +1,14 @@
 import pandas as pd
 import os
-from api.models import UrbanInstituteRentalCrisisData
+from api.facets import build_catalog
+from api.models import LoadManifest, UrbanInstituteRentalCrisisData
+from data.loaders.copy_loader import copy_rows
+from data.loaders.manifest import file_hash, load_scope
 import boto3
 
+# bumped when the way the source is parsed changes, so that every partition is reloaded
+LOADER_VERSION = 1
+
 BUCKET_NAME = 'hacko-data-archive'
 KEY = '2018-housing-affordability/data/urbaninstitute/'
 s3 = boto3.resource('s3')
@@ -37,15 +43,6 @@ class DjangoImport(object):
         """
         raise NotImplementedError("process_frame must be implemented by child class.")
         
-    def generate_objects(self):
-        """
-        Generator function to create Django objects to save to the database. Takes the json generated from 
-        self.generate_json and creates objects out of it.
-        """
-        for body in self.generate_json():
-            obj = self.django_model(**body)
-            yield obj
-
     def get_queryset(self):
         """
         Returns all objects that come from this particular import e.g. for sheet A-1 import it will return all objects with source A-1
@@ -57,7 +54,7 @@ class DjangoImport(object):
 
     def save(self, delete_existing=True, query=None):
         """
-        Adds the dataframe to the database via the Django ORM using self.generate_objects to generate Django objects.
+        Adds the dataframe to the database with copy_rows using the json generated by self.generate_json.
         
         Parameters:
             delete_existing: option to delete the existing items for this import
@@ -68,16 +65,15 @@ class DjangoImport(object):
         if self.df is None:
             raise Exception("self.df has not been set, nothing to add to database.")
             
+        qs = None
         if delete_existing:
             if query is None:
                 qs = self.get_queryset()
             else:
-                qs = django_model.objects.filter(query)
-            # delete existing items in index
-            qs.delete()
+                qs = self.django_model.objects.filter(query)
 
-        results = self.django_model.objects.bulk_create(self.generate_objects(), batch_size=10000)
-        return len(results)
+        # only the rows that changed are deleted and added, in the same transaction
+        return copy_rows(self.django_model, self.generate_json(), replace=qs, diff=True)
         
     def is_valid_value(self, val):
         try:
@@ -131,18 +127,38 @@ class UrbanInstituteImport(DjangoImport):
 
             yield body
 
-def load_data():
+def load_data(full=False):
     files = [
         'HAI_map_2000.csv',
         'HAI_map_2005-09.csv',
         'HAI_map_2010-14.csv',
     ]
 
+    # each file is the partition of one year
+    imports = {}
+    hashes = {}
     for f in files:
         key = KEY + f
         file_path = '/data/urbaninstitute/{}'.format(f)
         if not os.path.isfile(file_path):
             s3.Bucket(BUCKET_NAME).download_file(key, file_path)
         i = UrbanInstituteImport(file_loc=file_path)
-        i.save()
+        imports[str(i.year)] = i
+        hashes[str(i.year)] = file_hash(file_path)
+
+    if not full:
+        hashes = LoadManifest.objects.changed(UrbanInstituteRentalCrisisData, hashes, version=LOADER_VERSION)
+        if not hashes:
+            print('Urban Institute files are unchanged')
+            return
+
+    with load_scope(UrbanInstituteRentalCrisisData, full=full):
+        for year in hashes:
+            imports[year].save()
+
+        print('Ranked {} rows'.format(UrbanInstituteRentalCrisisData.objects.refresh_rank()))
+    LoadManifest.objects.record(UrbanInstituteRentalCrisisData, hashes, version=LOADER_VERSION, replace=full)
+    build_catalog(UrbanInstituteRentalCrisisData, ['county_name', 'state_name'], extra_values={
+        'geography': UrbanInstituteRentalCrisisData.objects.geographies(),
+    })
 